@@ -0,0 +1,467 @@
+"""
+A local stand-in for the GitHub REST API, serving a synthetic repository for benchmarks.
+
+It serves owner/repo, its issues, pulls, branches, tags, releases, contributors, stargazers,
+collaborators, contributor stats, and users, with realistic payloads, page-based pagination with Link
+headers, ETags (answering conditional requests with 304), rate limit headers, configurable latency,
+and 202 responses from the stats endpoint until it has been "computed". GraphQL queries for users
+and branches, as aliased user(login:) and ref(qualifiedName:) fields, are answered too, with
+NOT_FOUND errors for missing ones (as for bot contributors, which aren't users in GraphQL).
+
+Run standalone with: python bench/fake_github.py --size 1000 --port 8765
+The API is served under /api/v3, as for GitHub Enterprise, so point ghizmo at it with github_url.
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+__author__ = 'jlevy'
+
+OWNER = "octo"
+REPO = "bench"
+API_PREFIX = "/api/v3"
+
+TIMESTAMP = "2020-01-01T00:00:00Z"
+
+# A contributor that's an app, so is in the REST API but not a User in GraphQL.
+BOT = "dependabot[bot]"
+
+GRAPHQL_PATH = "/api/graphql"
+
+_GRAPHQL_USER = re.compile(r"(\w+)\s*:\s*user\(login:\s*\$(\w+)\)")
+_GRAPHQL_REF = re.compile(r"(\w+)\s*:\s*ref\(qualifiedName:\s*\$(\w+)\)")
+_GRAPHQL_REPOSITORY = re.compile(r"repository\(owner:\s*\$(\w+),\s*name:\s*\$(\w+)\)")
+
+
+class Dataset(object):
+  """
+  Synthetic data for one repository, scaled by size.
+  """
+
+  def __init__(self, size):
+    self.size = size
+    self.users = ["user%d" % i for i in range(max(size // 10, 5))]
+    self.contributors = self.users + [BOT]
+    self.branches = ["master"] + ["feature-%d" % i for i in range(size // 4)]
+    self.issues = size
+    self.pulls = size // 2
+    self.stargazers = size
+    self.tags = size // 10
+    self.releases = size // 20
+
+
+class FakeGitHub(object):
+  """
+  Payloads and routing for the fake API, plus request counting and rate limit state.
+  """
+
+  def __init__(self, dataset, base_url, latency=0.0, per_page_default=30, rate_limit=5000, stats_pending=2):
+    self.data = dataset
+    self.base_url = base_url.rstrip("/")
+    self.api = self.base_url + API_PREFIX
+    self.latency = latency
+    self.per_page_default = per_page_default
+    self.rate_limit = rate_limit
+    self.remaining = rate_limit
+    self.reset = int(time.time()) + 3600
+    self.stats_pending = stats_pending
+    self.request_count = 0
+    self.not_modified_count = 0
+    self._lock = threading.Lock()
+    self.repo_api = "%s/repos/%s/%s" % (self.api, OWNER, REPO)
+    self.repo_html = "%s/%s/%s" % (self.base_url, OWNER, REPO)
+
+  # Payloads.
+
+  def user(self, login, full=False):
+    url = "%s/users/%s" % (self.api, login)
+    user = {
+      "login": login, "id": int(hashlib.md5(login.encode()).hexdigest()[:6], 16), "node_id": "U_" + login,
+      "avatar_url": "%s/avatars/%s" % (self.base_url, login), "gravatar_id": "", "url": url,
+      "html_url": "%s/%s" % (self.base_url, login), "followers_url": url + "/followers",
+      "following_url": url + "/following{/other_user}", "gists_url": url + "/gists{/gist_id}",
+      "starred_url": url + "/starred{/owner}{/repo}", "subscriptions_url": url + "/subscriptions",
+      "organizations_url": url + "/orgs", "repos_url": url + "/repos", "events_url": url + "/events{/privacy}",
+      "received_events_url": url + "/received_events", "type": "Bot" if login == BOT else "User",
+      "site_admin": False,
+    }
+    if full:
+      user.update({
+        "name": login.title(), "company": None, "blog": "", "location": None, "email": None, "hireable": None,
+        "bio": None, "twitter_username": None, "public_repos": 3, "public_gists": 0, "followers": 1, "following": 1,
+        "created_at": TIMESTAMP, "updated_at": TIMESTAMP,
+      })
+    return user
+
+  def repository(self):
+    api = self.repo_api
+    repo = {
+      "id": 1, "node_id": "R_1", "name": REPO, "full_name": "%s/%s" % (OWNER, REPO), "private": False,
+      "owner": self.user(OWNER), "html_url": self.repo_html, "description": "Benchmark repository", "fork": False,
+      "url": api, "homepage": None, "language": "Python", "forks_count": 0, "stargazers_count": self.data.stargazers,
+      "watchers_count": self.data.stargazers, "size": 100, "default_branch": "master",
+      "open_issues_count": self.data.issues // 2, "is_template": False, "topics": [], "has_issues": True,
+      "has_projects": False, "has_wiki": False, "has_pages": False, "has_downloads": True, "archived": False,
+      "disabled": False, "visibility": "public", "pushed_at": TIMESTAMP, "created_at": TIMESTAMP,
+      "updated_at": TIMESTAMP, "permissions": {"admin": True, "push": True, "pull": True},
+      "subscribers_count": 1, "network_count": 0, "forks": 0, "open_issues": self.data.issues // 2, "watchers": 1,
+      "mirror_url": None, "license": None, "allow_rebase_merge": True, "allow_squash_merge": True,
+      "allow_merge_commit": True, "delete_branch_on_merge": False,
+      "git_url": "git://example.com/%s/%s.git" % (OWNER, REPO), "ssh_url": "git@example.com:%s/%s.git" % (OWNER, REPO),
+      "clone_url": self.repo_html + ".git", "svn_url": self.repo_html,
+    }
+    for name in ["archive_url", "assignees_url", "blobs_url", "branches_url", "collaborators_url", "comments_url",
+                 "commits_url", "compare_url", "contents_url", "contributors_url", "deployments_url", "downloads_url",
+                 "events_url", "forks_url", "git_commits_url", "git_refs_url", "git_tags_url", "hooks_url",
+                 "issue_comment_url", "issue_events_url", "issues_url", "keys_url", "labels_url", "languages_url",
+                 "merges_url", "milestones_url", "notifications_url", "pulls_url", "releases_url", "stargazers_url",
+                 "statuses_url", "subscribers_url", "subscription_url", "tags_url", "teams_url", "trees_url"]:
+      repo[name] = "%s/%s" % (api, name[:-4])
+    return repo
+
+  def short_repository(self):
+    repo = self.repository()
+    for key in ["permissions", "subscribers_count", "network_count", "allow_rebase_merge", "allow_squash_merge",
+                "allow_merge_commit", "delete_branch_on_merge"]:
+      repo.pop(key, None)
+    return repo
+
+  def label(self, name):
+    return {"id": hash(name) & 0xffff, "node_id": "L_" + name, "url": "%s/labels/%s" % (self.repo_api, name),
+            "name": name, "color": "ededed", "default": False, "description": None}
+
+  def issue(self, number, pull=False):
+    author = self.data.users[number % len(self.data.users)]
+    assignee = self.user(self.data.users[(number + 1) % len(self.data.users)]) if number % 3 == 0 else None
+    url = "%s/issues/%d" % (self.repo_api, number)
+    issue = {
+      "id": number, "node_id": "I_%d" % number, "url": url, "repository_url": self.repo_api,
+      "labels_url": url + "/labels{/name}", "comments_url": url + "/comments", "events_url": url + "/events",
+      "html_url": "%s/issues/%d" % (self.repo_html, number), "number": number,
+      "state": "open" if number % 2 else "closed", "title": "Issue number %d" % number,
+      "body": "Synthetic issue body for issue %d. " % number * 4, "body_html": "<p>Synthetic issue body</p>",
+      "body_text": "Synthetic issue body", "user": self.user(author),
+      "labels": [self.label("bug")] if number % 5 == 0 else [], "assignee": assignee,
+      "assignees": [assignee] if assignee else [], "milestone": None, "locked": False, "active_lock_reason": None,
+      "comments": number % 7, "closed_at": None if number % 2 else TIMESTAMP, "created_at": TIMESTAMP,
+      "updated_at": "2020-01-%02dT00:00:00Z" % (number % 28 + 1), "closed_by": None, "author_association": "MEMBER",
+    }
+    if pull:
+      issue["pull_request"] = {"url": "%s/pulls/%d" % (self.repo_api, number),
+                               "html_url": "%s/pull/%d" % (self.repo_html, number),
+                               "diff_url": "%s/pull/%d.diff" % (self.repo_html, number),
+                               "patch_url": "%s/pull/%d.patch" % (self.repo_html, number)}
+    return issue
+
+  def pull(self, number):
+    issue = self.issue(number)
+    url = "%s/pulls/%d" % (self.repo_api, number)
+    branch = self.data.branches[number % len(self.data.branches)] if number % 2 == 0 else "deleted-%d" % number
+    issue.update({
+      "url": url, "html_url": "%s/pull/%d" % (self.repo_html, number),
+      "diff_url": "%s/pull/%d.diff" % (self.repo_html, number),
+      "patch_url": "%s/pull/%d.patch" % (self.repo_html, number),
+      "issue_url": "%s/issues/%d" % (self.repo_api, number), "commits_url": url + "/commits",
+      "review_comments_url": url + "/comments", "review_comment_url": "%s/pulls/comments{/number}" % self.repo_api,
+      "comments_url": "%s/issues/%d/comments" % (self.repo_api, number),
+      "statuses_url": "%s/statuses/%040d" % (self.repo_api, number), "merged_at": None,
+      "merge_commit_sha": None, "requested_reviewers": [], "requested_teams": [], "draft": False,
+      "head": {"label": "%s:%s" % (OWNER, branch), "ref": branch, "sha": "%040d" % number, "user": self.user(OWNER),
+               "repo": self.short_repository()},
+      "base": {"label": "%s:master" % OWNER, "ref": "master", "sha": "%040d" % 0, "user": self.user(OWNER),
+               "repo": self.short_repository()},
+      "_links": {"self": {"href": url}, "html": {"href": "%s/pull/%d" % (self.repo_html, number)},
+                 "issue": {"href": "%s/issues/%d" % (self.repo_api, number)},
+                 "comments": {"href": "%s/issues/%d/comments" % (self.repo_api, number)},
+                 "review_comments": {"href": url + "/comments"}, "review_comment": {"href": url + "/comments{/number}"},
+                 "commits": {"href": url + "/commits"},
+                 "statuses": {"href": "%s/statuses/%040d" % (self.repo_api, number)}},
+    })
+    for key in ["labels_url", "events_url", "repository_url", "closed_by", "comments", "pull_request"]:
+      issue.pop(key, None)
+    return issue
+
+  def short_branch(self, name):
+    sha = hashlib.sha1(name.encode()).hexdigest()
+    return {"name": name, "commit": {"sha": sha, "url": "%s/commits/%s" % (self.repo_api, sha)}, "protected": False}
+
+  def branch(self, name):
+    branch = self.short_branch(name)
+    sha = branch["commit"]["sha"]
+    person = {"name": "Octo", "email": "octo@example.com", "date": TIMESTAMP}
+    branch["commit"].update({
+      "node_id": "C_" + sha, "html_url": "%s/commit/%s" % (self.repo_html, sha),
+      "comments_url": "%s/commits/%s/comments" % (self.repo_api, sha),
+      "commit": {"author": person, "committer": person, "message": "Commit on %s" % name,
+                 "tree": {"sha": sha, "url": "%s/git/trees/%s" % (self.repo_api, sha)},
+                 "url": "%s/git/commits/%s" % (self.repo_api, sha), "comment_count": 0},
+      "author": self.user(OWNER), "committer": self.user(OWNER), "parents": [],
+    })
+    branch["_links"] = {"self": "%s/branches/%s" % (self.repo_api, name), "html": "%s/tree/%s" % (self.repo_html, name)}
+    branch["protection"] = {"enabled": False, "required_status_checks": {"enforcement_level": "off", "contexts": []}}
+    branch["protection_url"] = "%s/branches/%s/protection" % (self.repo_api, name)
+    return branch
+
+  def tag(self, i):
+    name = "v0.%d" % i
+    sha = hashlib.sha1(name.encode()).hexdigest()
+    return {"name": name, "commit": {"sha": sha, "url": "%s/commits/%s" % (self.repo_api, sha)},
+            "zipball_url": "%s/zipball/%s" % (self.repo_api, name),
+            "tarball_url": "%s/tarball/%s" % (self.repo_api, name),
+            "node_id": "T_" + name}
+
+  def release(self, i):
+    url = "%s/releases/%d" % (self.repo_api, i)
+    return {"url": url, "html_url": "%s/releases/v0.%d" % (self.repo_html, i), "assets_url": url + "/assets",
+            "upload_url": "%s/releases/%d/assets{?name,label}" % (self.repo_api, i), "tarball_url": None,
+            "zipball_url": None, "id": i, "node_id": "RE_%d" % i, "tag_name": "v0.%d" % i,
+            "target_commitish": "master", "name": "Release %d" % i, "body": "Notes", "draft": False,
+            "prerelease": False, "created_at": TIMESTAMP, "published_at": TIMESTAMP, "author": self.user(OWNER),
+            "assets": []}
+
+  def contributor(self, i):
+    contributor = self.user(self.data.contributors[i])
+    contributor["contributions"] = len(self.data.contributors) - i
+    return contributor
+
+  def stargazer(self, i):
+    # Shaped as for the star+json media type, which clients request to get starred_at.
+    return {"starred_at": TIMESTAMP, "user": self.user("stargazer%d" % i)}
+
+  def collaborator(self, i):
+    collaborator = self.user(self.data.users[i])
+    collaborator["permissions"] = {"admin": False, "push": True, "pull": True}
+    return collaborator
+
+  def contributor_stats(self):
+    return [{"author": self.user(login), "total": 10 + i,
+             "weeks": [{"w": 1577836800 + week * 604800, "a": 1, "d": 1, "c": 1} for week in range(52)]}
+            for (i, login) in enumerate(self.data.users)]
+
+  def graphql_user(self, login):
+    user = self.user(login, full=True)
+    if login == BOT or not (login == OWNER or login in set(self.data.users) or re.match(r"^stargazer\d+$", login)):
+      return None
+    return {
+      "login": login, "databaseId": user["id"], "avatarUrl": user["avatar_url"], "url": user["html_url"],
+      "name": user["name"], "company": None, "websiteUrl": None, "location": None, "email": "", "bio": None,
+      "isHireable": False, "twitterUsername": None, "createdAt": TIMESTAMP, "updatedAt": TIMESTAMP,
+      "isSiteAdmin": False, "followers": {"totalCount": 1}, "following": {"totalCount": 1},
+      "repositories": {"totalCount": 3}, "gists": {"totalCount": 0},
+    }
+
+  def graphql_ref(self, qualified_name):
+    name = qualified_name[len("refs/heads/"):] if qualified_name.startswith("refs/heads/") else None
+    if name not in set(self.data.branches):
+      return None
+    branch = self.branch(name)
+    commit = branch["commit"]
+    return {
+      "name": name, "branchProtectionRule": None,
+      "target": {"oid": commit["sha"], "url": commit["html_url"], "message": commit["commit"]["message"],
+                 "author": commit["commit"]["author"], "committer": commit["commit"]["committer"],
+                 "parents": {"nodes": []}},
+    }
+
+  def graphql(self, request):
+    """
+    Answer the queries ghizmo makes: aliased user(login:) fields, or aliased ref(qualifiedName:) fields
+    within a repository. Missing items are null, with a NOT_FOUND error, as GitHub does.
+    """
+    query = request.get("query") or ""
+    variables = request.get("variables") or {}
+    errors = []
+
+    def not_found(path, kind, name):
+      errors.append({"type": "NOT_FOUND", "path": path, "locations": [{"line": 1, "column": 1}],
+                     "message": "Could not resolve to a %s with the name of '%s'." % (kind, name)})
+
+    def fields(pattern, lookup, kind, path=()):
+      result = {}
+      for (alias, variable) in pattern.findall(query):
+        result[alias] = lookup(variables.get(variable))
+        if result[alias] is None:
+          not_found(list(path) + [alias], kind, variables.get(variable))
+      return result
+
+    m = _GRAPHQL_REPOSITORY.search(query)
+    if m:
+      (owner, name) = (variables.get(m.group(1)), variables.get(m.group(2)))
+      if (owner, name) != (OWNER, REPO):
+        not_found(["repository"], "Repository", "%s/%s" % (owner, name))
+        data = {"repository": None}
+      else:
+        data = {"repository": fields(_GRAPHQL_REF, self.graphql_ref, "Ref", ["repository"])}
+    else:
+      data = fields(_GRAPHQL_USER, self.graphql_user, "User")
+    if not data and not errors:
+      return (200, {"errors": [{"message": "Unsupported query (the fake server only looks up users and refs)"}]}, {})
+    result = {"data": data}
+    if errors:
+      result["errors"] = errors
+    return (200, result, {})
+
+  # Routing.
+
+  def list_route(self, path):
+    """
+    Return (total, item function) for list endpoints, or None.
+    """
+    repo_path = "/repos/%s/%s" % (OWNER, REPO)
+    routes = {
+      repo_path + "/issues": (self.data.issues, lambda i: self.issue(i + 1, pull=i < self.data.pulls)),
+      repo_path + "/pulls": (self.data.pulls, lambda i: self.pull(i + 1)),
+      repo_path + "/branches": (len(self.data.branches), lambda i: self.short_branch(self.data.branches[i])),
+      repo_path + "/tags": (self.data.tags, self.tag),
+      repo_path + "/releases": (self.data.releases, self.release),
+      repo_path + "/contributors": (len(self.data.contributors), self.contributor),
+      repo_path + "/collaborators": (len(self.data.users), self.collaborator),
+      repo_path + "/stargazers": (self.data.stargazers, self.stargazer),
+    }
+    return routes.get(path)
+
+  def handle(self, method, path, query, body=None):
+    """
+    Return (status, body, extra headers) for a request.
+    """
+    if path == GRAPHQL_PATH:
+      if method != "POST":
+        return (404, {"message": "Not Found"}, {})
+      return self.graphql(json.loads(body or b"{}"))
+    if not path.startswith(API_PREFIX):
+      return (404, {"message": "Not Found"}, {})
+    path = path[len(API_PREFIX):].rstrip("/") or "/"
+    repo_path = "/repos/%s/%s" % (OWNER, REPO)
+
+    if path == "/rate_limit":
+      core = {"limit": self.rate_limit, "remaining": self.remaining, "reset": self.reset, "used": 0}
+      return (200, {"resources": {"core": core}, "rate": core}, {})
+    if path == repo_path:
+      return (200, self.repository(), {})
+    if path == repo_path + "/stats/contributors":
+      with self._lock:
+        if self.stats_pending > 0:
+          self.stats_pending -= 1
+          return (202, {}, {})
+      return (200, self.contributor_stats(), {})
+    m = re.match(r"^/users/([^/]+)$", path)
+    if m:
+      return (200, self.user(m.group(1), full=True), {})
+    m = re.match(r"^%s/branches/(.+)$" % re.escape(repo_path), path)
+    if m:
+      if m.group(1) not in set(self.data.branches):
+        return (404, {"message": "Branch not found"}, {})
+      return (200, self.branch(m.group(1)), {})
+
+    route = self.list_route(path)
+    if route:
+      (total, item) = route
+      return self.page(path, query, total, item)
+    return (404, {"message": "Not Found"}, {})
+
+  def page(self, path, query, total, item):
+    per_page = min(int(query.get("per_page", self.per_page_default)), 100)
+    page = int(query.get("page", 1))
+    last = max((total + per_page - 1) // per_page, 1)
+    items = [item(i) for i in range((page - 1) * per_page, min(page * per_page, total))]
+
+    def link(number, rel):
+      params = dict(query, page=number, per_page=per_page)
+      return '<%s%s?%s>; rel="%s"' % (self.api, path, urlencode(params), rel)
+
+    links = []
+    if page < last:
+      links += [link(page + 1, "next"), link(last, "last")]
+    if page > 1:
+      links += [link(1, "first"), link(page - 1, "prev")]
+    return (200, items, {"Link": ", ".join(links)} if links else {})
+
+  def count(self):
+    with self._lock:
+      self.request_count += 1
+      self.remaining = max(self.remaining - 1, 0)
+      return self.remaining
+
+
+def make_handler(fake):
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this, delayed ACKs add ~40ms to each request.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+      self._respond("GET")
+
+    def do_DELETE(self):
+      self._respond("DELETE")
+
+    def do_POST(self):
+      self._respond("POST", self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+
+    def _respond(self, method, request_body=None):
+      remaining = fake.count()
+      if fake.latency:
+        time.sleep(fake.latency)
+      parts = urlparse(self.path)
+      (status, payload, headers) = fake.handle(method, parts.path, dict(parse_qsl(parts.query)), request_body)
+      body = json.dumps(payload).encode("utf-8")
+      etag = '"%s"' % hashlib.sha1(body).hexdigest()
+      if status == 200 and self.headers.get("If-None-Match") == etag:
+        with fake._lock:
+          fake.not_modified_count += 1
+        (status, body) = (304, b"")
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json; charset=utf-8")
+      self.send_header("Content-Length", str(len(body)))
+      self.send_header("ETag", etag)
+      self.send_header("X-RateLimit-Limit", str(fake.rate_limit))
+      self.send_header("X-RateLimit-Remaining", str(remaining))
+      self.send_header("X-RateLimit-Reset", str(fake.reset))
+      self.send_header("X-RateLimit-Resource", "graphql" if parts.path == GRAPHQL_PATH else "core")
+      for (key, value) in headers.items():
+        self.send_header(key, value)
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  return Handler
+
+
+def start(size, host="127.0.0.1", port=0, **options):
+  """
+  Start a fake server in a background thread. Returns (server, fake); call server.shutdown() to stop.
+  """
+  server = ThreadingHTTPServer((host, port), None)
+  server.daemon_threads = True
+  fake = FakeGitHub(Dataset(size), "http://%s:%s" % (host, server.server_port), **options)
+  server.RequestHandlerClass = make_handler(fake)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return (server, fake)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Fake GitHub API server for benchmarks")
+  parser.add_argument("--size", type=int, default=1000, help="dataset size (number of issues, etc.)")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency to add to each request")
+  args = parser.parse_args()
+  (server, fake) = start(args.size, port=args.port, latency=args.latency)
+  print("Serving %s/%s (size %s) at %s" % (OWNER, REPO, args.size, fake.base_url))
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    server.shutdown()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,193 @@
+"""
+Benchmark ghizmo commands against a local fake GitHub API server (see fake_github.py).
+
+Each command is run as a separate process, as a user would run it, at each dataset size, recording wall
+time, number of API requests, and peak memory (max RSS). Results can be saved with --save and compared
+against an earlier run (say, from another version) with --compare:
+
+  python bench/run_bench.py --sizes 100,1000 --save before.json
+  ... change things ...
+  python bench/run_bench.py --sizes 100,1000 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_github
+
+__author__ = 'jlevy'
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = [100, 1000, 5000]
+
+
+
+def branch_names(data):
+  return data.branches
+
+
+def user_logins(data):
+  # Includes a bot, which GraphQL doesn't find as a user.
+  return data.contributors
+
+
+# Benchmarks to run, as (name, command, extra command-line arguments, function giving stdin values from the
+# dataset or None). The --graphql variants show the difference from REST in time and requests.
+COMMANDS = [
+  ("issues", "issues", ["-a", "state=all"], None),
+  ("pull-requests", "pull-requests", ["-a", "state=all"], None),
+  ("branches", "branches", [], None),
+  ("branches-full", "branches-full", [], None),
+  ("branches-full --graphql", "branches-full", ["--graphql"], None),
+  ("show-branches", "show-branches", [], branch_names),
+  ("show-branches --graphql", "show-branches", ["--graphql"], branch_names),
+  ("show-users", "show-users", [], user_logins),
+  ("show-users --graphql", "show-users", ["--graphql"], user_logins),
+  ("tags", "tags", [], None),
+  ("releases", "releases", [], None),
+  ("contributors", "contributors", [], None),
+  ("collaborators", "collaborators", [], None),
+  ("stargazers", "stargazers", [], None),
+  ("contributor-stats", "contributor-stats", [], None),
+  ("stale-pr-branches", "stale-pr-branches", [], None),
+  ("assemble-authors", "assemble-authors", [], None),
+  ("assemble-authors --graphql", "assemble-authors", ["--graphql"], None),
+]
+
+# Everyone without a group goes into the last group, which has no members.
+AUTHORS_INFO = "roles: {}\nexclude: []\ngroups:\n  - name: Contributors\n"
+
+
+def write_config(home, server_url):
+  """
+  Write a ~/.ghizmo.yml pointing at the fake server, with the HTTP cache off so every run is cold.
+  """
+  with open(os.path.join(home, ".ghizmo.yml"), "w") as f:
+    f.write("access_token: fake-token\n")
+    f.write("github_url: %s\n" % server_url)
+    f.write("http_cache: false\n")
+
+
+def run_command(command, extra_args, work_dir, env, jobs=None, input_path=os.devnull):
+  """
+  Run one command to completion, with stdin from input_path, discarding its output. Returns (exit code,
+  seconds, peak RSS in KB).
+  """
+  argv = [sys.executable, "-m", "ghizmo.main", command, "--repo", "%s/%s" % (fake_github.OWNER, fake_github.REPO),
+          "--format", "ndjson"] + extra_args
+  if jobs:
+    argv += ["--jobs", str(jobs)]
+  start = time.time()
+  with open(os.devnull, "w") as devnull, open(os.path.join(work_dir, "stderr.log"), "a") as stderr, \
+          open(input_path) as stdin:
+    process = subprocess.Popen(argv, cwd=work_dir, env=env, stdin=stdin, stdout=devnull, stderr=stderr)
+    (_, status, usage) = os.wait4(process.pid, 0)
+  elapsed = time.time() - start
+  # ru_maxrss is in KB on Linux.
+  return (os.waitstatus_to_exitcode(status), elapsed, usage.ru_maxrss)
+
+
+def run_all(sizes, commands, latency=0.0, jobs=None, stats_pending=0):
+  results = []
+  for size in sizes:
+    (server, fake) = fake_github.start(size, latency=latency)
+    try:
+      with tempfile.TemporaryDirectory(prefix="ghizmo-bench-") as tmp:
+        home = os.path.join(tmp, "home")
+        work_dir = os.path.join(tmp, "work")
+        os.makedirs(home)
+        os.makedirs(work_dir)
+        write_config(home, fake.base_url)
+        with open(os.path.join(work_dir, "authors-info.yml"), "w") as f:
+          f.write(AUTHORS_INFO)
+        env = dict(os.environ, HOME=home, GHIZMO_CACHE_DIR=os.path.join(tmp, "cache"),
+                   PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_DIR, os.environ.get("PYTHONPATH")])))
+
+        for (name, command, extra_args, values) in commands:
+          fake.stats_pending = stats_pending
+          input_path = os.devnull
+          if values:
+            input_path = os.path.join(tmp, "input.json")
+            with open(input_path, "w") as f:
+              f.writelines("%s\n" % json.dumps(value) for value in values(fake.data))
+          before = fake.request_count
+          (code, elapsed, max_rss) = run_command(command, extra_args, work_dir, env, jobs=jobs, input_path=input_path)
+          result = {"command": name, "size": size, "seconds": round(elapsed, 3),
+                    "requests": fake.request_count - before, "max_rss_kb": max_rss, "exit_code": code}
+          print_result(result)
+          results.append(result)
+    finally:
+      server.shutdown()
+      server.server_close()
+  return results
+
+
+def print_header():
+  print("%-26s %7s %9s %9s %11s %s" % ("command", "size", "seconds", "requests", "max_rss_mb", "status"))
+
+
+def print_result(result, baseline=None):
+  line = "%-26s %7d %9.3f %9d %11.1f %s" % (result["command"], result["size"], result["seconds"], result["requests"],
+                                            result["max_rss_kb"] / 1024.0, "ok" if result["exit_code"] == 0 else
+                                            "FAILED (%s)" % result["exit_code"])
+  if baseline:
+    line += "  (time %+.0f%%, requests %+d, rss %+.0f%%)" % (
+      _change(baseline["seconds"], result["seconds"]), result["requests"] - baseline["requests"],
+      _change(baseline["max_rss_kb"], result["max_rss_kb"]))
+  print(line)
+  sys.stdout.flush()
+
+
+def _change(old, new):
+  return 100.0 * (new - old) / old if old else 0.0
+
+
+def compare(results, baseline_results):
+  baseline = {(r["command"], r["size"]): r for r in baseline_results}
+  print("\nCompared to baseline:")
+  print_header()
+  for result in results:
+    print_result(result, baseline.get((result["command"], result["size"])))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark ghizmo commands against a fake GitHub API server")
+  parser.add_argument("--sizes", help="comma-separated dataset sizes (default %s)" % ",".join(map(str, DEFAULT_SIZES)))
+  parser.add_argument("--commands", help="comma-separated benchmark names to run (default all)")
+  parser.add_argument("--latency", type=float, default=0.0, help="seconds of latency to add to each request")
+  parser.add_argument("-j", "--jobs", type=int, help="pass --jobs to each command")
+  parser.add_argument("--stats-pending", type=int, default=0,
+                      help="number of 202 (still computing) responses from the stats endpoint before it has data")
+  parser.add_argument("--save", help="save results to this JSON file")
+  parser.add_argument("--compare", help="compare results to those saved in this JSON file")
+  args = parser.parse_args()
+
+  sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else DEFAULT_SIZES
+  commands = COMMANDS
+  if args.commands:
+    known = {entry[0]: entry for entry in COMMANDS}
+    commands = [known.get(name, (name, name, [], None)) for name in args.commands.split(",")]
+
+  print_header()
+  results = run_all(sizes, commands, latency=args.latency, jobs=args.jobs, stats_pending=args.stats_pending)
+
+  if args.save:
+    with open(args.save, "w") as f:
+      json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+      f.write("\n")
+  if args.compare:
+    with open(args.compare) as f:
+      compare(results, json.load(f)["results"])
+
+  if any(result["exit_code"] != 0 for result in results):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
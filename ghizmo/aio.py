@@ -0,0 +1,101 @@
+"""
+Support for commands written as async generators (or coroutines).
+
+Async commands get an AsyncClient as config.aio. It runs requests on the shared, authenticated GitHub
+session (so caching and rate limiting still apply) on a bounded pool, so a command can overlap many
+requests with asyncio.gather() or similar, without managing threads itself.
+"""
+
+import asyncio
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from ghizmo import pagination
+
+__author__ = 'jlevy'
+
+# Default maximum number of concurrent requests, if not set with --jobs.
+DEFAULT_LIMIT = 16
+
+_DONE = object()
+
+
+class AsyncClient(object):
+  """
+  Async access to the GitHub session, with at most `limit` requests in flight.
+  """
+
+  def __init__(self, github, limit=DEFAULT_LIMIT):
+    self.github = github
+    self.session = github.session
+    self.limit = limit
+    self._semaphore = asyncio.Semaphore(limit)
+    self._executor = ThreadPoolExecutor(max_workers=limit)
+
+  async def call(self, func, *args, **kwargs):
+    """
+    Run a blocking call, such as a github3 method, without blocking the event loop.
+    """
+    async with self._semaphore:
+      loop = asyncio.get_running_loop()
+      return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+  def url(self, path):
+    """
+    Full URL for an API path (like "/repos/owner/name"). Full URLs are returned unchanged.
+    """
+    if path.startswith("http://") or path.startswith("https://"):
+      return path
+    return self.session.base_url.rstrip("/") + "/" + path.lstrip("/")
+
+  async def get(self, path, **kwargs):
+    return await self.call(self.session.get, self.url(path), **kwargs)
+
+  async def get_json(self, path, **kwargs):
+    response = await self.get(path, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+  async def iterate(self, iterator):
+    """
+    Asynchronously iterate over a github3 list iterator (e.g. repo.issues()), fetching a page at a time.
+    """
+    cls = pagination.model_class(iterator)
+    remaining = iterator.count
+    pages = pagination.iter_pages(iterator)
+    while remaining != 0:
+      page = await self.call(next, pages, _DONE)
+      if page is _DONE:
+        break
+      for item in page.items:
+        yield cls(item)
+        if remaining > 0:
+          remaining -= 1
+          if remaining == 0:
+            break
+
+  def close(self):
+    self._executor.shutdown(wait=False)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    self.close()
+
+
+async def run(command_func, config, args, output):
+  """
+  Run an async command, passing each result to output.
+  """
+  async with AsyncClient(config.github, limit=args.get_int("jobs", None) or DEFAULT_LIMIT) as client:
+    result = command_func(config._replace(aio=client), args)
+    if inspect.isawaitable(result):
+      result = await result
+    if hasattr(result, "__aiter__"):
+      async for item in result:
+        output(item)
+    elif result:
+      for item in result:
+        output(item)
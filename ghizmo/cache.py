@@ -0,0 +1,173 @@
+"""
+Persistent on-disk cache of GitHub API responses.
+
+Bodies are stored with their ETag/Last-Modified validators, and later requests for the same URL are
+made conditional. GitHub answers unchanged resources with 304, which doesn't count against the rate
+limit, and the stored body is returned in its place.
+"""
+
+import logging as log
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from ghizmo.transport import WrappingAdapter, wrap_adapters
+
+__author__ = 'jlevy'
+
+DEFAULT_MAX_MB = 256
+
+# Headers that describe the transfer rather than the stored (already decoded) body.
+_UNSTORED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+_SCHEMA = """
+create table if not exists responses (
+  key text primary key,
+  url text not null,
+  status integer not null,
+  headers text not null,
+  body blob not null,
+  size integer not null,
+  accessed real not null
+);
+create index if not exists responses_accessed on responses (accessed);
+"""
+
+
+def cache_key(request):
+  """
+  Key on URL, media type, and auth scope. The credential itself is hashed, never stored.
+  """
+  parts = [request.url, request.headers.get("Accept", ""), request.headers.get("Authorization", "")]
+  return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache(object):
+  """
+  SQLite-backed response store, evicting least recently used entries beyond max_bytes.
+  Safe to share between threads.
+  """
+
+  def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.path = path
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute("pragma journal_mode=wal")
+    self._db.executescript(_SCHEMA)
+    self._total = self._db.execute("select coalesce(sum(size), 0) from responses").fetchone()[0]
+
+  def get(self, key):
+    with self._lock:
+      row = self._db.execute("select url, status, headers, body from responses where key = ?",
+                             (key,)).fetchone()
+      if not row:
+        return None
+      self._db.execute("update responses set accessed = ? where key = ?", (time.time(), key))
+    (url, status, headers, body) = row
+    return {"url": url, "status": status, "headers": json.loads(headers), "body": body}
+
+  def put(self, key, url, status, headers, body):
+    headers = {k: v for (k, v) in headers.items() if k.lower() not in _UNSTORED_HEADERS}
+    size = len(body)
+    with self._lock:
+      old = self._db.execute("select size from responses where key = ?", (key,)).fetchone()
+      self._db.execute("insert or replace into responses values (?, ?, ?, ?, ?, ?, ?)",
+                       (key, url, status, json.dumps(headers), body, size, time.time()))
+      self._total += size - (old[0] if old else 0)
+      if self._total > self.max_bytes:
+        self._evict()
+
+  def _evict(self):
+    # Trim to 90% of the limit so we don't evict on every write once full.
+    target = self.max_bytes * 0.9
+    rows = self._db.execute("select key, size from responses order by accessed").fetchall()
+    evicted = []
+    for (key, size) in rows:
+      if self._total <= target:
+        break
+      evicted.append((key,))
+      self._total -= size
+    self._db.executemany("delete from responses where key = ?", evicted)
+    log.debug("HTTP cache: evicted %s entries", len(evicted))
+
+  def clear(self):
+    with self._lock:
+      self._db.execute("delete from responses")
+      self._total = 0
+
+  def close(self):
+    with self._lock:
+      self._db.close()
+
+
+class CachingAdapter(WrappingAdapter):
+  """
+  Adapter that makes GETs conditional on cached validators and serves the cached body on 304.
+  Responses served from the cache have from_cache set to True.
+  """
+
+  def __init__(self, inner, cache):
+    super().__init__(inner)
+    self.cache = cache
+
+  def send(self, request, **kwargs):
+    # Leave alone streamed downloads and requests that are already conditional (e.g. github3 etags).
+    if (request.method != "GET" or kwargs.get("stream") or "If-None-Match" in request.headers
+            or "If-Modified-Since" in request.headers):
+      return self.inner.send(request, **kwargs)
+
+    key = cache_key(request)
+    entry = self.cache.get(key)
+    if entry:
+      etag = entry["headers"].get("ETag")
+      last_modified = entry["headers"].get("Last-Modified")
+      if etag:
+        request.headers["If-None-Match"] = etag
+      if last_modified:
+        request.headers["If-Modified-Since"] = last_modified
+
+    response = self.inner.send(request, **kwargs)
+    response.from_cache = False
+
+    if response.status_code == 304 and entry:
+      response.close()
+      return self._cached_response(request, response, entry)
+    if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+      self.cache.put(key, request.url, response.status_code, response.headers, response.content)
+    return response
+
+  def _cached_response(self, request, not_modified, entry):
+    response = Response()
+    response.status_code = entry["status"]
+    response.reason = "OK (cached)"
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    # Fresh headers (rate limit counts, dates) come from the 304 itself.
+    response.headers.update({k: v for (k, v) in not_modified.headers.items()
+                             if k.lower() not in _UNSTORED_HEADERS})
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = entry["body"]
+    response._content_consumed = True
+    response.url = request.url
+    response.request = request
+    response.connection = self
+    response.from_cache = True
+    return response
+
+
+def install(session, path, max_bytes):
+  """
+  Add a persistent response cache to a requests session. Returns the cache.
+  """
+  cache = ResponseCache(path, max_bytes=max_bytes)
+  log.info("HTTP cache: %s", path)
+  wrap_adapters(session, lambda adapter: CachingAdapter(adapter, cache))
+  return cache
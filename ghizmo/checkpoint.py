@@ -0,0 +1,93 @@
+"""
+Checkpoints for list commands writing to a file with --output, so an interrupted run can be continued
+with --resume.
+
+As pages are consumed, the output is periodically made durable and a checkpoint saved with the URL of
+the next page, the number of items output, and the position in the output file. Resuming cuts the
+output back to that position and continues from that page, so records are neither repeated nor lost.
+"""
+
+import logging as log
+import os
+import json
+import time
+import hashlib
+
+from ghizmo import configs
+from ghizmo import pagination
+
+__author__ = 'jlevy'
+
+CHECKPOINT_SECONDS = 5.0
+
+_VERSION = 1
+
+
+class Checkpointer(object):
+  """
+  Runs paginated listings with checkpoints, for output to a sink (an output.FileSink) through a
+  formatter. The key identifies the run's output settings, so a checkpoint is only resumed by the
+  same command writing the same output.
+  """
+
+  def __init__(self, sink, formatter, key, resume=False):
+    self.sink = sink
+    self.formatter = formatter
+    self.key = key
+    self.resume = resume
+
+  def _path(self, iterator):
+    listing = json.dumps([_VERSION, self.key, iterator.url, sorted(iterator.params.items())], default=str)
+    digest = hashlib.sha1(listing.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(configs.cache_dir(), "checkpoints", "%s.json" % digest)
+
+  def _load(self, path):
+    state = configs.load_state(path)
+    return state if state and state.get("version") == _VERSION else None
+
+  def _checkpoint(self, path, next_url, items):
+    # Once output up to here is durable, the writer saves where it got to.
+    self.formatter.flush()
+    state = {"version": _VERSION, "key": self.key, "next_url": next_url, "items": items}
+    self.sink.checkpoint(lambda position: configs.save_state(path, dict(state, position=position, time=time.time())))
+
+  def iter_items(self, iterator, jobs=1, raw=False):
+    """
+    Yield the items of a github3 iterator, as iter_items() or iter_raw_items() would, saving checkpoints
+    along the way, and with resume, continuing from the last one.
+    """
+    path = self._path(iterator)
+    state = self._load(path) if self.resume else None
+    if state:
+      self.sink.restore(state["position"])
+      log.warning("Resuming after %s items (from checkpoint %s)", state["items"], path)
+    else:
+      if self.resume:
+        log.warning("No checkpoint to resume from, so starting from the beginning")
+      # Any earlier checkpoint is for output that's about to be overwritten.
+      _remove(path)
+
+    skip = state["items"] if state else 0
+    cls = pagination.model_class(iterator)
+
+    def items():
+      count = skip
+      last_checkpoint = time.time()
+      for page in pagination.iter_pages(iterator, jobs=jobs, start_url=state and state["next_url"]):
+        for item in page.items:
+          yield item if raw and isinstance(item, dict) else cls(item)
+        count += len(page.items)
+        if page.next_url and time.time() - last_checkpoint >= CHECKPOINT_SECONDS:
+          self._checkpoint(path, page.next_url, count)
+          last_checkpoint = time.time()
+
+    for item in pagination.limit_items(iterator, items(), skip=skip):
+      yield item
+    # Done, so drop the checkpoint, after any still being saved.
+    self.formatter.flush()
+    self.sink.checkpoint(lambda position: _remove(path))
+
+
+def _remove(path):
+  if os.path.exists(path):
+    os.unlink(path)
@@ -1,20 +1,61 @@
 from ghizmo.commands import lib
+from ghizmo import configs
+from ghizmo import graphql
+from ghizmo import stats
 
 import os
 import yaml
 import urllib.parse
 from collections import defaultdict
+from collections import OrderedDict
+from github3.exceptions import NotFoundError
 
 _AUTHORS_INFO_FILES = ["authors-info.yml", "authors-info.json", "admin/authors-info.yml", "admin/authors-info.json"]
 
+# Default concurrency for user lookups, if not set with --jobs.
+_USER_LOOKUP_JOBS = 8
+
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _issue_state_path(repo):
+  return os.path.join(configs.cache_dir(), "authors", "%s.json" % repo.full_name)
+
+
+def _user_or_none(github, login):
+  try:
+    return github.user(login)
+  except NotFoundError:
+    return None
+
+
+def _lookup_users(config, args, logins):
+  """
+  Look up users, yielding (login, user dict or None) in order. With --graphql, logins are resolved in
+  batched queries, or otherwise with concurrent REST requests.
+  """
+  jobs = args.get_int("jobs", None) or _USER_LOOKUP_JOBS
+  if args.get_bool("graphql"):
+    client = graphql.GraphQLClient(config.github.session)
+    for (batch, users, error) in lib.parallel_map(client.users, lib.batches(logins, graphql.BATCH_SIZE), jobs=jobs):
+      if error:
+        raise error
+      for (login, user) in zip(batch, users):
+        yield (login, user)
+  else:
+    for (login, user, error) in lib.parallel_map(lambda login: _user_or_none(config.github, login), logins, jobs=jobs):
+      if error:
+        raise error
+      yield (login, user and user.as_dict())
+
 
 def assemble_authors(config, args):
   """
   Assemble a list of authors as an AUTHORS.md file based on GitHub repo history and a
   authors-info.{yml,json} file. Supports roles (for each person) and groups of people
-  (leads, contributors, etc.).
+  (leads, contributors, etc.). Issue tallies are updated incrementally; use -a full_rebuild=true to
+  recount from scratch.
   """
-  github = config.github
   repo = config.repo
   authors_info_filename = None
   for filename in _AUTHORS_INFO_FILES:
@@ -40,25 +81,32 @@ def assemble_authors(config, args):
   else:
     yield lib.status("No roles file")
 
-  login_to_user = {}
-  for contributor in repo.contributors():
-    user = github.user(contributor.login)
-    login_to_user[user.login] = user
+  # Fetch contributors once. Then look up each distinct login, for contributors and for anyone with a
+  # role who is somehow missing from the contributors returned by the API (for example the commits
+  # weren't linked up to the account properly), concurrently.
+  contributor_logins = [contributor.login for contributor in repo.contributors()]
+  contributors_found = set(contributor_logins)
+  role_logins = [login for login in roles if login not in contributors_found]
+  logins = list(OrderedDict.fromkeys(contributor_logins + role_logins))
 
-  # If any roles are listed but were somehow missing from the contributors return by the API
-  # (for example the commits weren't linked up to the account properly), include them too.
-  contributors_found = {contributor.login for contributor in repo.contributors()}
+  login_to_user = {}
   unknown_contributors = []
-  for login in roles:
-    if login not in contributors_found:
-      user = github.user(login)
-      if user:
-        yield lib.status("Author has a role but is not returned by GitHub as a contributor: %s (%s)" % (login, user))
-      else:
-        yield lib.status("Author has a role but is not a contributor or a known user: %s [%s]" % (user, type(user)))
+  for (login, user) in _lookup_users(config, args, logins):
+    if login in contributors_found:
+      # Some contributors, like bots (dependabot[bot]), have no user to look up, so are listed by login.
+      if not user:
         unknown_contributors.append(login)
-
       login_to_user[login] = user
+      continue
+
+    if user:
+      yield lib.status("Author has a role but is not returned by GitHub as a contributor: %s (%s)"
+                       % (login, user["name"]))
+    else:
+      yield lib.status("Author has a role but is not a contributor or a known user: %s [%s]" % (user, type(user)))
+      unknown_contributors.append(login)
+
+    login_to_user[login] = user
 
   yield lib.status("Found %s authors" % len(login_to_user))
   yield lib.status("Found without GitHub user info: %s" % unknown_contributors)
@@ -100,17 +148,34 @@ def assemble_authors(config, args):
       raise ValueError("Missing login name")
 
   commit_tallies = {}
-  for stat in repo.contributor_statistics():
-    yield lib.status("contrib stat: login '%s' total '%s'" % (stat.author.login, stat.total))
-    commit_tallies[stat.author.login] = stat.total
+  repo_stats = stats.contributor_stats([repo], ttl=args.get_float("stats_ttl", None),
+                                       wait=args.get_float("stats_wait", None))[repo.full_name]
+  for stat in repo_stats:
+    yield lib.status("contrib stat: login '%s' total '%s'" % (stat["author"]["login"], stat["total"]))
+    commit_tallies[stat["author"]["login"]] = stat["total"]
 
   yield lib.status("Read %s contributor stats" % len(commit_tallies))
 
+  # Issue/PR authors are kept in a local state file, so later runs only fetch what was updated since.
+  state_path = _issue_state_path(repo)
+  state = None if args.get_bool("full_rebuild") else configs.load_state(state_path)
+  if state:
+    yield lib.status("Updating issue tallies since %s (from %s)" % (state["since"], state_path))
+  else:
+    state = {"since": None, "authors": {}}
+
+  updated_count = 0
+  for issue in repo.issues(state="all", since=state["since"]):
+    state["authors"][str(issue.number)] = issue.user.login
+    state["since"] = max(state["since"] or "", issue.updated_at.strftime(_TIMESTAMP_FORMAT))
+    updated_count += 1
+  configs.save_state(state_path, state)
+
   issue_tallies = defaultdict(int)
-  for issue in repo.issues(state="all"):
-    issue_tallies[issue.user.login] += 1
+  for login in state["authors"].values():
+    issue_tallies[login] += 1
 
-  yield lib.status("Read %s issues/PRs" % len(issue_tallies))
+  yield lib.status("Read %s new or updated issues/PRs (%s total)" % (updated_count, len(state["authors"])))
 
   yield {"commit_tallies": commit_tallies, "issue_tallies": issue_tallies}
 
@@ -126,7 +191,7 @@ def assemble_authors(config, args):
         user = login_to_user.get(login)
         role = roles.get(login)
 
-        name = user.name if user else None
+        name = user["name"] if user else None
         if login in exclude:
           continue
 
@@ -154,3 +219,8 @@ def assemble_authors(config, args):
       f.write("\n%s\n\n" % footer)
 
     f.write("\n(This file was auto-generated by [ghizmo assemble-authors](https://github.com/jlevy/ghizmo).)")
+
+
+# With --repos, have GitHub compute stats for all repositories at once.
+assemble_authors.prepare_repos = stats.prepare_repos
+assemble_authors.concurrency = lambda jobs: jobs or _USER_LOOKUP_JOBS
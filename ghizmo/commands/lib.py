@@ -4,8 +4,17 @@ Common functions for commands.
 
 # TODO: Move this module elsewhere?
 
+import logging as log
 import sys
+import re
 import json
+import codecs
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 __author__ = 'jlevy'
 
@@ -14,21 +23,297 @@ def status(message, dry_run=False):
   return {"message": message, "dry_run": dry_run}
 
 
-def process_input(function):
+def failure(item, error):
+  """
+  Inline report of a failure processing one input item, so one bad item doesn't end the run.
+  """
+  return {"input": item, "error": str(error), "error_type": type(error).__name__}
+
+
+def _call(function, item):
+  try:
+    return (item, function(item), None)
+  except Exception as e:
+    return (item, None, e)
+
+
+def parallel_map(function, items, jobs=1, ordered=True):
+  """
+  Apply function to each item, using up to `jobs` worker threads, and yield (item, result, error)
+  triples. Items are consumed lazily, with a bounded number in flight at once. Results are in input
+  order unless ordered is False, in which case each is yielded as soon as it completes.
+  """
+  if not jobs or jobs <= 1:
+    for item in items:
+      yield _call(function, item)
+    return
+
+  max_pending = jobs * 2
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    pending = deque()
+    for item in items:
+      pending.append(executor.submit(_call, function, item))
+      if len(pending) >= max_pending:
+        if ordered:
+          yield pending.popleft().result()
+        else:
+          (done, not_done) = wait(pending, return_when=FIRST_COMPLETED)
+          for future in done:
+            yield future.result()
+          pending = deque(not_done)
+    if ordered:
+      while pending:
+        yield pending.popleft().result()
+    else:
+      while pending:
+        (done, not_done) = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          yield future.result()
+        pending = deque(not_done)
+
+
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 2.0
+
+
+def is_transient(error):
+  """
+  Whether an error may well succeed on retry: network errors and server errors. (Rate limits are already
+  waited out and retried by the session, see ratelimit.py.)
+  """
+  code = getattr(error, "code", None)  # HTTP status, on github3 errors.
+  if isinstance(code, int):
+    return code >= 500
+  return isinstance(error, OSError) or any(cls.__name__ == "TransportError" for cls in type(error).__mro__)
+
+
+def retry(function, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, is_retryable=is_transient):
+  """
+  Call function, retrying with jittered exponential backoff on transient errors.
+  """
+  for attempt in range(attempts):
+    try:
+      return function()
+    except Exception as e:
+      if attempt + 1 >= attempts or not is_retryable(e):
+        raise
+      delay = backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+      log.info("Retrying in %.1fs after error: %s", delay, e)
+      time.sleep(delay)
+
+
+def process_input(function, args=None):
   """
   Just for brevity, a generic handler to look up and process based on input.
+  With args, honors the --jobs and --unordered options. Failures are yielded inline.
+  """
+  jobs = args.get_int("jobs", 1) if args else 1
+  ordered = not args.get_bool("unordered") if args else True
+  for (item, result, error) in parallel_map(function, input_json_lines(), jobs=jobs, ordered=ordered):
+    yield failure(item, error) if error else result
+
+
+def batches(items, size):
+  """
+  Group an iterable into lists of up to size items.
+  """
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def process_input_batches(function, args=None, size=100):
+  """
+  Like process_input, but function looks up a list of items at once and returns a list of results,
+  with None for any item that wasn't found.
+  """
+  jobs = args.get_int("jobs", 1) if args else 1
+  ordered = not args.get_bool("unordered") if args else True
+  for (batch, results, error) in parallel_map(function, batches(input_json_lines(), size), jobs=jobs, ordered=ordered):
+    for (i, item) in enumerate(batch):
+      if error:
+        yield failure(item, error)
+      elif results[i] is None:
+        yield failure(item, LookupError("Not found: %s" % item))
+      else:
+        yield results[i]
+
+
+# Size of reads from stdin when parsing JSON input.
+INPUT_CHUNK_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+_number_tail = re.compile(r"[0-9.eE+-]*")
+_LITERALS = ["true", "false", "null", "NaN", "Infinity", "-Infinity"]
+
+
+def _may_continue(buffer, error):
+  """
+  Whether a decoding error could just be because the value continues past the end of the buffer.
+  """
+  rest = buffer[error.pos:]
+  if error.msg.startswith("Unterminated string"):
+    return True
+  if error.msg.startswith("Invalid \\uXXXX"):
+    return len(rest) < 6
+  return (_number_tail.match(rest).end() == len(rest) or
+          (error.msg == "Expecting value" and any(literal.startswith(rest) for literal in _LITERALS)))
+
+
+class _StreamPosition(object):
+  """
+  Tracks where in a stream a buffer starts, so errors can be reported relative to the whole stream.
+  """
+
+  def __init__(self):
+    self.offset = 0
+    self.line = 1
+    self.line_start = 0
+
+  def advance(self, text):
+    newlines = text.count("\n")
+    if newlines:
+      self.line += newlines
+      self.line_start = self.offset + text.rindex("\n") + 1
+    self.offset += len(text)
+
+  def error(self, buffer, error):
+    at = _StreamPosition()
+    (at.offset, at.line, at.line_start) = (self.offset, self.line, self.line_start)
+    at.advance(buffer[:error.pos])
+    return ValueError("Invalid JSON input: %s: line %s column %s (char %s)"
+                      % (error.msg, at.line, at.offset - at.line_start + 1, at.offset))
+
+
+def _chunk_reader(stream):
+  """
+  A function to read up to a given number of characters from a text stream, returning as soon as any
+  are available (rather than waiting to fill the whole chunk, as read() does on a pipe), or "" at EOF.
+  """
+  read1 = getattr(getattr(stream, "buffer", None), "read1", None)
+  if not read1:
+    return stream.read
+  decoder = codecs.getincrementaldecoder(stream.encoding or "utf-8")(errors=stream.errors or "strict")
+
+  def read(size):
+    while True:
+      data = read1(size)
+      text = decoder.decode(data, final=not data)
+      # A read can end partway through a multibyte character, leaving nothing to return yet.
+      if text or not data:
+        return text
+
+  return read
+
+
+def input_json_values(stream=None, chunk_size=INPUT_CHUNK_SIZE):
+  """
+  Read a stream of JSON values, whether newline-delimited, concatenated, or pretty-printed (as jq
+  outputs by default). Input is read in chunks of up to chunk size, as it arrives, so each value is
+  yielded as soon as it's complete, and only the unparsed remainder is buffered, so memory use is
+  bounded by chunk size and the largest single value.
+  """
+  read = _chunk_reader(stream or sys.stdin)
+  position = _StreamPosition()
+  buffer = ""
+  pos = 0
+  eof = False
+  read_size = chunk_size
+  while True:
+    pos = _whitespace.match(buffer, pos).end()
+    if pos == len(buffer):
+      if eof:
+        return
+      position.advance(buffer)
+      (buffer, pos) = (read(read_size), 0)
+      eof = not buffer
+      continue
+    try:
+      (value, end) = _decoder.raw_decode(buffer, pos)
+    except json.JSONDecodeError as e:
+      # Read more only if the value may continue past the end of the buffer (in growing chunks, to stay
+      # linear in the size of very large values). Otherwise it's invalid, whatever follows.
+      if eof or not _may_continue(buffer, e):
+        raise position.error(buffer, e) from None
+      end = None
+    # A value that runs to the end of the buffer (e.g. a number) could also be incomplete.
+    if end is None or (not eof and _number_tail.match(buffer, end).end() == len(buffer)):
+      chunk = read(read_size)
+      eof = not chunk
+      position.advance(buffer[:pos])
+      (buffer, pos) = (buffer[pos:] + chunk, 0)
+      read_size *= 2
+      continue
+    read_size = chunk_size
+    pos = end
+    yield value
+
+
+class _SharedInput(object):
+  """
+  Values read once from stdin and replayed to each reader, in any thread. Values are read only as the
+  furthest reader needs them, and any read error is raised for every reader that gets to it.
+  """
+
+  def __init__(self, values):
+    self._values = values
+    self._read = []
+    self._error = None
+    self._done = False
+    self._lock = threading.Lock()
+
+  def __iter__(self):
+    index = 0
+    while True:
+      with self._lock:
+        if index == len(self._read):
+          if self._error:
+            raise self._error
+          if self._done:
+            return
+          try:
+            self._read.append(next(self._values))
+          except StopIteration:
+            self._done = True
+            return
+          except Exception as e:
+            self._error = e
+            raise
+        value = self._read[index]
+      index += 1
+      yield value
+
+
+_shared_input = None
+
+
+@contextmanager
+def shared_input():
+  """
+  Within this context, every command reading stdin (as when run on each of several repos) gets the
+  same values, rather than each getting whatever part of stdin it happens to read first.
   """
-  for item in input_json_lines():
-    yield function(item)
+  global _shared_input
+  _shared_input = _SharedInput(input_json_values())
+  try:
+    yield
+  finally:
+    _shared_input = None
 
 
 def input_json_lines():
   """
-  Read line-delimited JSON stream.
-  TODO: Handle jq-style streamed JSON that need not be line delimited.
+  Read JSON values from stdin. Despite the name, values need not be line delimited.
   """
-  for line in sys.stdin:
-    yield json.loads(line)
+  if _shared_input:
+    return iter(_shared_input)
+  return input_json_values()
 
 
 def to_bool(str):
@@ -1,4 +1,10 @@
 from ghizmo.commands import lib
+from ghizmo import pagination
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Default concurrency for fetching pages, if not set with --jobs.
+_PAGE_JOBS = 4
 
 
 def stale_pr_branches(config, args):
@@ -6,10 +12,24 @@ def stale_pr_branches(config, args):
   List "stale" PR branches, i.e. those for a closed PR from the same, non-forked repository.
   """
   repo = config.repo
-  for pr in repo.pull_requests(state="closed"):
-    if pr.head.repo == pr.base.repo and repo.branch(pr.head.ref):
+  jobs = args.get_int("jobs", None) or _PAGE_JOBS
+  # Rather than looking up the head branch of each PR, page through all branches once (in the
+  # background, while closed PRs are listed) and check against that set.
+  with ThreadPoolExecutor(max_workers=1) as executor:
+    future_branches = executor.submit(
+      lambda: {branch.name for branch in pagination.iter_items(repo.branches(), jobs=jobs)})
+    candidates = [pr for pr in pagination.iter_items(repo.pull_requests(state="closed"), jobs=jobs)
+                  if pr.head.repo == pr.base.repo]
+    branch_names = future_branches.result()
+
+  for pr in candidates:
+    if pr.head.ref in branch_names:
       yield {
         "html_url": pr.html_url,
         "base_branch": pr.base.ref,
         "head_branch": pr.head.ref,
       }
+
+
+# Branches and closed PRs are each paged through with this many requests at once.
+stale_pr_branches.concurrency = lambda jobs: 2 * (jobs or _PAGE_JOBS)
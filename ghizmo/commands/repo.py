@@ -1,4 +1,13 @@
 from ghizmo.commands import lib
+from ghizmo import graphql
+from ghizmo import mirror
+from ghizmo import stats
+
+from collections import OrderedDict
+from github3.exceptions import NotFoundError
+
+# Default concurrency for deletions, if not set with --jobs.
+_DELETE_JOBS = 4
 
 
 def tags(config, args):
@@ -12,17 +21,83 @@ def show_tags(config, args):
   """
   Show info for tags supplied on stdin.
   """
-  for item in lib.input_json_lines():
-    yield config.repo.tag(item)
+  return lib.process_input(config.repo.tag, args)
+
+
+class _RefNotFound(ValueError):
+  pass
+
 
+def _get_ref(repo, ref_name):
+  try:
+    return repo.ref(ref_name)
+  except NotFoundError:
+    return None
 
-def _delete_ref(repo, ref_name, force, dry_run):
-  ref = repo.ref(ref_name)
-  if not ref and not force:
-    raise ValueError("Reference not found: %s" % ref_name)
+
+def _lookup_ref(repo, ref_name):
+  return lib.retry(lambda: _get_ref(repo, ref_name))
+
+
+def _delete_ref(ref_name, ref, dry_run):
+  """
+  Delete a looked-up ref, returning (outcome, status).
+  """
+  if not ref:
+    return ("missing", lib.status("Not found (skipped) %s" % ref_name, dry_run=dry_run))
   if not dry_run:
-    ref.delete()
-  return lib.status("Deleted %s" % ref_name, dry_run=dry_run)
+    lib.retry(ref.delete)
+  return ("deleted", lib.status("Deleted %s" % ref_name, dry_run=dry_run))
+
+
+def _lookup_all_refs(repo, ref_names, jobs):
+  """
+  Look up every ref before any is deleted, returning (ref_name, ref, error) triples, so a missing ref
+  stops the whole deletion rather than whatever happens to come after it.
+  """
+  found = []
+  missing = []
+  for (ref_name, ref, error) in lib.parallel_map(lambda name: _lookup_ref(repo, name), ref_names, jobs=jobs):
+    if not ref and not error:
+      missing.append(ref_name)
+    else:
+      found.append((ref_name, ref, error))
+  if missing:
+    raise _RefNotFound("Reference not found: %s" % ", ".join(missing))
+  return found
+
+
+def _delete_looked_up(entry, dry_run):
+  (ref_name, ref, error) = entry
+  if error:
+    raise error
+  return _delete_ref(ref_name, ref, dry_run)
+
+
+def _delete_refs(repo, ref_names, args):
+  """
+  Delete refs concurrently, with retries, reporting each and then a summary. A missing ref is an error,
+  and then nothing is deleted, unless force is set, in which case it's skipped.
+  """
+  jobs = args.get_int("jobs", None) or _DELETE_JOBS
+  counts = OrderedDict([("deleted", 0), ("missing", 0), ("failed", 0)])
+  ordered = not args.get_bool("unordered")
+  if args.force:
+    entries = ref_names
+    delete = lambda ref_name: _delete_ref(ref_name, _lookup_ref(repo, ref_name), args.dry_run)
+  else:
+    entries = _lookup_all_refs(repo, ref_names, jobs)
+    delete = lambda entry: _delete_looked_up(entry, args.dry_run)
+  for (entry, result, error) in lib.parallel_map(delete, entries, jobs=jobs, ordered=ordered):
+    ref_name = entry if args.force else entry[0]
+    if error:
+      counts["failed"] += 1
+      yield lib.failure(ref_name, error)
+    else:
+      (outcome, status) = result
+      counts[outcome] += 1
+      yield status
+  yield {"summary": counts, "dry_run": args.dry_run}
 
 
 def branches(config, args):
@@ -36,24 +111,36 @@ def branches_full(config, args):
   """
   List full info about all branches.
   """
-  for b in config.repo.branches():
-    yield config.repo.branch(b.name)
+  repo = config.repo
+  if args.get_bool("graphql"):
+    client = graphql.GraphQLClient(config.github.session)
+    names = (b.name for b in repo.branches())
+    for batch in lib.batches(names, graphql.BATCH_SIZE):
+      for branch in client.branches(repo.owner.login, repo.name, batch):
+        if branch:
+          yield branch
+  else:
+    for b in repo.branches():
+      yield repo.branch(b.name)
 
 
 def show_branches(config, args):
   """
   Show branches supplied on stdin.
   """
-  for item in lib.input_json_lines():
-    yield config.repo.branch(item)
+  repo = config.repo
+  if args.get_bool("graphql"):
+    client = graphql.GraphQLClient(config.github.session)
+    return lib.process_input_batches(lambda names: client.branches(repo.owner.login, repo.name, names), args,
+                                     size=graphql.BATCH_SIZE)
+  return lib.process_input(repo.branch, args)
 
 
 def delete_branches(config, args):
   """
   Delete branches supplied on stdin.
   """
-  for ref_name in lib.input_json_lines():
-    yield _delete_ref(config.repo, "heads/" + ref_name, args.force, args.dry_run)
+  return _delete_refs(config.repo, ("heads/" + ref_name for ref_name in lib.input_json_lines()), args)
 
 
 def refs(config, args):
@@ -67,22 +154,27 @@ def show_refs(config, args):
   """
   Show refs supplied on stdin.
   """
-  for item in lib.input_json_lines():
-    yield config.repo.ref(item)
+  return lib.process_input(config.repo.ref, args)
 
 
 def delete_refs(config, args):
   """
   Delete refs supplied on stdin.
   """
-  for ref_name in lib.input_json_lines():
-    yield _delete_ref(config.repo, ref_name, args.force, args.dry_run)
+  return _delete_refs(config.repo, lib.input_json_lines(), args)
+
+
+delete_branches.concurrency = delete_refs.concurrency = lambda jobs: jobs or _DELETE_JOBS
 
 
 def pull_requests(config, args):
   """
-  List all PRs.
+  List all PRs. With --local, list them from the local mirror, with optional filters.
   """
+  if args.get_bool("local"):
+    return mirror.query(config.repo.full_name, mirror.PULL, state=args.get("state", "open"),
+                        labels=args.get("labels"), assignee=args.get("assignee"), milestone=args.get("milestone"),
+                        sort=args.get("sort"), direction=args.get("direction"), number=args.get("number", -1))
   return config.repo.pull_requests(state=args.get("state", "open"))
 
 
@@ -95,9 +187,14 @@ def contributors(config, args):
 
 def contributor_stats(config, args):
   """
-  List contributor statistics.
+  List contributor statistics, waiting for GitHub to compute them if necessary.
   """
-  return config.repo.contributor_statistics()
+  return stats.contributor_stats([config.repo], ttl=args.get_float("stats_ttl", None),
+                                 wait=args.get_float("stats_wait", None))[config.repo.full_name]
+
+
+# With --repos, have GitHub compute stats for all repositories at once.
+contributor_stats.prepare_repos = stats.prepare_repos
 
 
 def collaborators(config, args):
@@ -132,10 +229,24 @@ def create_release(config, args):
 
 def issues(config, args):
   """
-  List issues.
+  List issues. With --local, list them from the local mirror.
   """
+  if args.get_bool("local"):
+    if args.get("mentioned"):
+      raise ValueError("The mentioned filter isn't supported with --local")
+    return mirror.query(config.repo.full_name, mirror.ISSUE, state=args.get("state"),
+                        labels=args.get("labels"), assignee=args.get("assignee"), milestone=args.get("milestone"),
+                        since=args.get("since"), sort=args.get("sort"), direction=args.get("direction"),
+                        number=args.get("number", -1))
   return config.repo.issues(milestone=args.get("milestone"), state=args.get("state"),
                             assignee=args.get("assignee"), mentioned=args.get("mentioned"),
                             labels=args.get("labels"), sort=args.get("sort"),
                             direction=args.get("direction"), since=args.get("since"),
                             number=args.get("number", -1))
+
+
+def sync(config, args):
+  """
+  Update the local mirror of issues and PRs (for use with --local). Use -a full_rebuild=true to start over.
+  """
+  return mirror.sync(config.repo, full=args.get_bool("full_rebuild"))
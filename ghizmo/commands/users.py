@@ -1,12 +1,15 @@
 from ghizmo.commands import lib
+from ghizmo import graphql
 
 
 def show_users(config, args):
   """
   Show user info for usernames supplied on stdin.
   """
-  for item in lib.input_json_lines():
-    yield config.github.user(item)
+  if args.get_bool("graphql"):
+    client = graphql.GraphQLClient(config.github.session)
+    return lib.process_input_batches(client.users, args, size=graphql.BATCH_SIZE)
+  return lib.process_input(config.github.user, args)
 
 
 def search_users(config, args):
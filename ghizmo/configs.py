@@ -5,7 +5,8 @@ Ghizmo config handling.
 import logging as log
 import os
 import re
-import yaml
+import json
+import threading
 import subprocess
 
 from functools import lru_cache
@@ -21,6 +22,7 @@ def load_config_file():
 
   parsed_configs = None
   if os.path.exists(path):
+    import yaml
     with open(path) as f:
       parsed_configs = yaml.safe_load(f)
 
@@ -38,18 +40,88 @@ def get_access_token():
   return configs and configs["access_token"]
 
 
+def get_setting(key, default=None):
+  """Return an optional setting from the config file."""
+  configs = load_config_file()
+  return configs.get(key, default) if configs else default
+
+
+def cache_dir():
+  """
+  Directory for local caches and state. Override with GHIZMO_CACHE_DIR.
+  """
+  if os.environ.get("GHIZMO_CACHE_DIR"):
+    return os.environ["GHIZMO_CACHE_DIR"]
+  base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.environ["HOME"], ".cache")
+  return os.path.join(base, "ghizmo")
+
+
+def load_state(path):
+  """
+  Read a JSON file of local state, as written by save_state(), or None if it's missing or unreadable.
+  """
+  try:
+    with open(path, "r", encoding="utf-8") as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+
+def save_state(path, state):
+  """
+  Write a JSON file of local state, durably and atomically, so readers (and later runs, even after a
+  crash) see either the old state or the new, never a partial file.
+  """
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  # Unique per writer, so concurrent saves of the same file don't collide.
+  tmp_path = "%s.%s.%s.tmp" % (path, os.getpid(), threading.get_ident())
+  try:
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump(state, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+    raise
+
+
 def _extract_github_repo_info(url):
   m = re.match("^git@github.com:([a-zA-Z0-9_-]+)/([a-zA-Z0-9_-]+).git$", url) or \
       re.match("^https://github.com/([a-zA-Z0-9_-]+)/([a-zA-Z0-9_-]+).git$", url)
   return (m.group(1), m.group(2)) if m else None
 
 
-def infer_repo(remote_name="origin"):
+def _git_config_mtime(path):
   """
-  Extract the current repository info, if available, using .git/config in current working directory.
+  Modification time of the git config for the repository enclosing path, if any.
   """
-  log.info("Checking in cwd for git dirctory: %s", os.getcwd())
-  remote_url = bytes.decode(subprocess.check_output(["git", "config", "--get", "remote.%s.url" % remote_name]))
+  while True:
+    for git_path in [os.path.join(path, ".git", "config"), os.path.join(path, ".git")]:
+      if os.path.exists(git_path):
+        return os.stat(git_path).st_mtime_ns
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+
+@lru_cache()
+def _infer_repo(cwd, remote_name, config_mtime):
+  remote_url = bytes.decode(subprocess.check_output(["git", "config", "--get", "remote.%s.url" % remote_name],
+                                                    cwd=cwd))
   (owner, repo_name) = _extract_github_repo_info(remote_url)
+  return (owner, repo_name)
+
+
+def infer_repo(remote_name="origin", cwd=None):
+  """
+  Extract the current repository info, if available, using .git/config in current working directory.
+  Results are remembered until the git config changes, which helps in a long-running process.
+  """
+  cwd = cwd or os.getcwd()
+  log.info("Checking in cwd for git dirctory: %s", cwd)
+  (owner, repo_name) = _infer_repo(cwd, remote_name, _git_config_mtime(cwd))
   log.info("Inferred repository: %s/%s", owner, repo_name)
   return (owner, repo_name)
@@ -0,0 +1,310 @@
+"""
+Optional long-lived daemon that runs ghizmo commands, so each call skips interpreter startup, imports,
+and config loading.
+
+Start it with `ghizmo-daemon` (or `python -m ghizmo.daemon`), and set GHIZMO_DAEMON=1 (or to a socket
+path) so that `ghizmo` forwards its arguments, working directory, and environment to it over a Unix
+socket. The client also passes its stdin, stdout, and stderr file descriptors, so the command reads and
+writes them directly, and output is exactly as if it ran locally. If the daemon isn't running, `ghizmo`
+just runs the command itself.
+
+Each request is run in a process forked from the daemon, so commands are isolated from each other
+(working directory, environment, and global state) but start with everything already imported.
+"""
+
+import logging as log
+import os
+import sys
+import json
+import array
+import struct
+import signal
+import socket
+import argparse
+import importlib
+
+__author__ = 'jlevy'
+
+SOCKET_FILENAME = "daemon.sock"
+
+# Requests are a length-prefixed JSON header, and replies are the child pid and then its exit code.
+_LENGTH = struct.Struct("!I")
+_INT = struct.Struct("!i")
+
+_STDIO_FDS = [0, 1, 2]
+
+_REQUEST_TIMEOUT = 10
+
+
+def socket_path(setting=None):
+  """
+  Socket path from a GHIZMO_DAEMON setting: a path, or "1" for the default in the cache directory.
+  """
+  if setting and setting not in ("1", "true", "yes"):
+    return setting
+  from ghizmo import configs
+  return os.path.join(configs.cache_dir(), SOCKET_FILENAME)
+
+
+def _send_fds(sock, data, fds):
+  sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+
+
+def _recv_fds(sock, size, max_fds):
+  fds = array.array("i")
+  (data, ancdata, flags, addr) = sock.recvmsg(size, socket.CMSG_LEN(max_fds * fds.itemsize))
+  for (level, kind, cmsg_data) in ancdata:
+    if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+      fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+  return (data, list(fds))
+
+
+def _recv_exactly(sock, size):
+  chunks = []
+  while size:
+    chunk = sock.recv(size)
+    if not chunk:
+      raise EOFError("Connection closed")
+    chunks.append(chunk)
+    size -= len(chunk)
+  return b"".join(chunks)
+
+
+# Client side.
+
+def run_client(setting, argv):
+  """
+  Run a command line on the daemon. Returns the exit code, or None if the daemon isn't reachable.
+  """
+  path = socket_path(setting)
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except OSError as e:
+    log.info("Daemon not available at %s (%s), running locally", path, e)
+    sock.close()
+    return None
+
+  with sock:
+    header = json.dumps({"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}).encode("utf-8")
+    _send_fds(sock, _LENGTH.pack(len(header)), _STDIO_FDS)
+    sock.sendall(header)
+    (pid,) = _INT.unpack(_recv_exactly(sock, _INT.size))
+    while True:
+      try:
+        (code,) = _INT.unpack(_recv_exactly(sock, _INT.size))
+        return code
+      except KeyboardInterrupt:
+        # The command runs in the daemon's process group, so pass the interrupt along.
+        os.kill(pid, signal.SIGINT)
+      except EOFError:
+        print("error: daemon process %s exited unexpectedly" % pid, file=sys.stderr)
+        return 2
+
+
+# Server side.
+
+def _warm_up():
+  """
+  Import everything commands are likely to need, so forked processes start with it loaded.
+  """
+  from ghizmo import configs
+  from ghizmo import manifest
+  from ghizmo import ghizmo
+  import github3  # noqa: F401
+  for name in ["main", "cache", "ratelimit", "transport", "instrument", "graphql", "mirror", "aio", "pagination"]:
+    importlib.import_module("ghizmo.%s" % name)
+  for name in manifest.command_module_names():
+    if name != "ghizmo_commands":
+      importlib.import_module(name)
+  configs.load_config_file()
+  return ghizmo
+
+
+def _config_mtime():
+  from ghizmo import configs
+  try:
+    return os.stat(os.path.join(os.environ["HOME"], configs.CONFIG_FILENAME)).st_mtime_ns
+  except OSError:
+    return None
+
+
+def _check_peer(conn):
+  # Only serve the user running the daemon (the socket is private too, but be sure).
+  if hasattr(socket, "SO_PEERCRED"):
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    (pid, uid, gid) = struct.unpack("3i", creds)
+    if uid != os.getuid():
+      raise PermissionError("Connection from another user (uid %s)" % uid)
+
+
+def _read_request(conn):
+  conn.settimeout(_REQUEST_TIMEOUT)
+  (data, fds) = _recv_fds(conn, _LENGTH.size, len(_STDIO_FDS))
+  try:
+    if len(fds) != len(_STDIO_FDS):
+      raise ValueError("Expected %s file descriptors, got %s" % (len(_STDIO_FDS), len(fds)))
+    data += _recv_exactly(conn, _LENGTH.size - len(data))
+    (length,) = _LENGTH.unpack(data)
+    request = json.loads(_recv_exactly(conn, length).decode("utf-8"))
+  except Exception:
+    for fd in fds:
+      os.close(fd)
+    raise
+  conn.settimeout(None)
+  return (request, fds)
+
+
+def _run_child(listener, conn, request, fds, ghizmo):
+  """
+  Run one request in a forked process, then exit with the command's exit code.
+  """
+  code = 1
+  try:
+    listener.close()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    conn.sendall(_INT.pack(os.getpid()))
+
+    for (fd, target) in zip(fds, _STDIO_FDS):
+      os.dup2(fd, target)
+      os.close(fd)
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    os.environ.pop("GHIZMO_DAEMON", None)
+    sys.argv = ["ghizmo"] + request["argv"]
+
+    # Logging is set up afresh per command, and available commands depend on the working directory.
+    log.root.handlers = []
+    ghizmo.all_command_functions.cache_clear()
+    ghizmo.command_directory.cache_clear()
+    ghizmo.list_commands.cache_clear()
+
+    from ghizmo import main
+    try:
+      main.main()
+      code = 0
+    except SystemExit as e:
+      code = _exit_code(e)
+    except BaseException:
+      try:
+        sys.excepthook(*sys.exc_info())
+      except SystemExit as e:
+        code = _exit_code(e)
+    for stream in [sys.stdout, sys.stderr]:
+      try:
+        stream.flush()
+      except OSError:
+        pass
+    conn.sendall(_INT.pack(code))
+  finally:
+    os._exit(code)
+
+
+def _exit_code(e):
+  if e.code is None or isinstance(e.code, int):
+    return e.code or 0
+  print(e.code, file=sys.stderr)
+  return 1
+
+
+def _reap():
+  # Collect any forked processes that have finished.
+  try:
+    while os.waitpid(-1, os.WNOHANG)[0]:
+      pass
+  except ChildProcessError:
+    pass
+
+
+def serve(path, idle_timeout=None):
+  """
+  Serve requests on a Unix socket until interrupted (or idle for idle_timeout seconds).
+  """
+  ghizmo = _warm_up()
+  config_mtime = _config_mtime()
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  if os.path.exists(path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      probe.connect(path)
+      raise RuntimeError("A daemon is already running at %s" % path)
+    except ConnectionRefusedError:
+      os.unlink(path)
+    finally:
+      probe.close()
+
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  old_umask = os.umask(0o077)
+  try:
+    listener.bind(path)
+  finally:
+    os.umask(old_umask)
+  listener.listen(64)
+  listener.settimeout(idle_timeout or None)
+
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  print("ghizmo daemon serving at %s" % path, file=sys.stderr)
+
+  from ghizmo import configs
+  try:
+    while True:
+      try:
+        (conn, addr) = listener.accept()
+      except socket.timeout:
+        print("ghizmo daemon idle for %ss, exiting" % idle_timeout, file=sys.stderr)
+        return
+      finally:
+        _reap()
+      with conn:
+        try:
+          _check_peer(conn)
+          (request, fds) = _read_request(conn)
+        except Exception as e:
+          log.warning("Bad request: %s", e)
+          continue
+
+        # Reload the config file in the daemon if it changed, so later commands don't each re-read it.
+        mtime = _config_mtime()
+        if mtime != config_mtime:
+          configs.load_config_file.cache_clear()
+          configs.load_config_file()
+          config_mtime = mtime
+
+        if os.fork() == 0:
+          _run_child(listener, conn, request, fds, ghizmo)
+        for fd in fds:
+          os.close(fd)
+
+      # Remember the repository for this directory, so the next command run there doesn't look it up.
+      try:
+        configs.infer_repo(cwd=request["cwd"])
+      except Exception:
+        pass
+  finally:
+    listener.close()
+    if os.path.exists(path):
+      os.unlink(path)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="ghizmo daemon: runs ghizmo commands for clients with "
+                                               "GHIZMO_DAEMON set, over a Unix socket")
+  parser.add_argument("--socket", help="socket path (default: %s in the cache directory)" % SOCKET_FILENAME)
+  parser.add_argument("--idle-timeout", help="exit after this many seconds with no requests", type=float)
+  args = parser.parse_args()
+  log.basicConfig(format="%(message)s", level=log.WARN, stream=sys.stderr)
+  try:
+    serve(args.socket or socket_path(os.environ.get("GHIZMO_DAEMON")), idle_timeout=args.idle_timeout)
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
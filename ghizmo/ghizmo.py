@@ -7,43 +7,87 @@ import logging as log
 import sys
 import re
 import json
-import yaml
 import inspect
 import os
 import importlib
 import getpass
+import time
+import queue
+import fnmatch
+import threading
+import functools
 from collections import namedtuple
 from collections import OrderedDict
 from functools import lru_cache
-import github3  # github3.py pip
-from github3.null import NullObject
+from concurrent.futures import ThreadPoolExecutor
 
 from ghizmo import configs
-from ghizmo import commands
+from ghizmo import manifest
+from ghizmo import pagination
+from ghizmo import projection
+from ghizmo.commands import lib
+
+# Note github3, yaml, and the transport layers are imported only when needed, to keep startup fast.
 
 __author__ = 'jlevy'
 
+FORMATS = ["json", "ndjson", "yaml"]
+
+# Buffered (ndjson) output is written out once it reaches this size or age.
+FLUSH_BYTES = 64 * 1024
+FLUSH_SECONDS = 1.0
+
+
 def read_login_info(username=None):
   if not username:
     username = eval(input("GitHub username: "))
   return (username, getpass.getpass())
 
 
-def login(username=None):
+def login(username=None, use_cache=True, concurrency=None, transport_settings=None):
+  """
+  Log in, returning a GitHub object whose session is set up with pooling, rate limiting, and caching.
+  Transport settings come from ~/.ghizmo.yml, updated with transport_settings, and the connection pool is
+  sized for the given number of concurrent requests.
+  """
+  import github3  # github3.py pip
+  from ghizmo import cache
+  from ghizmo import ratelimit
+  from ghizmo import transport
+
+  # For GitHub Enterprise (or a local stand-in server), github_url is the base URL of the installation.
+  github_url = configs.get_setting("github_url")
   token = configs.get_access_token()
   if token:
     log.info("Using access token authentication")
-    return github3.login(token=token)
+    gh = github3.enterprise_login(url=github_url, token=token) if github_url else github3.login(token=token)
   else:
     username = username or configs.get_username()
-    return github3.login(*read_login_info(username=username))
+    (username, password) = read_login_info(username=username)
+    if github_url:
+      gh = github3.enterprise_login(username=username, password=password, url=github_url)
+    else:
+      gh = github3.login(username, password)
+
+  if not gh:
+    return gh
+
+  # Transport layers wrap the network adapter in order, so the cache sits outside rate limiting.
+  transport.install(gh.session, transport.settings(configs.get_setting("transport"), transport_settings,
+                                                   concurrency=concurrency))
+  ratelimit.install(gh.session)
+  if use_cache and configs.get_setting("http_cache", True):
+    cache.install(gh.session, os.path.join(configs.cache_dir(), "http-cache.sqlite"),
+                  max_bytes=configs.get_setting("http_cache_mb", cache.DEFAULT_MAX_MB) * 1024 * 1024)
+  return gh
 
 
 def format_to_string(obj, format=None):
   if not format:
     format = "json"
 
-  if isinstance(obj, NullObject):
+  null = sys.modules.get("github3.null")
+  if null and isinstance(obj, null.NullObject):
     raise ValueError("Command returned null type (invalid input?): %s" % repr(obj))
 
   # Heuristic to convert github3 objects to serializable form.
@@ -52,22 +96,86 @@ def format_to_string(obj, format=None):
 
   if format == "json":
     return json.dumps(obj, sort_keys=True, indent=2) + "\n"
+  elif format == "ndjson":
+    return _compact_json(obj) + "\n"
   elif format == "yaml":
+    import yaml
     return yaml.safe_dump(obj, default_style='"')
   else:
     raise AssertionError("Invalid format: %s" % format)
 
 
-def print_formatter(format=None):
-  def printer(obj):
-    print(format_to_string(obj, format), end="")
-    sys.stdout.flush()
-
-  return printer
-
-
-# All data used by the run of a command.
-Config = namedtuple("Config", "github repo formatter")
+@lru_cache()
+def _orjson():
+  # Optional faster JSON encoder, used for compact output when installed (imported only when needed).
+  try:
+    import orjson
+    return orjson
+  except ImportError:
+    return None
+
+
+def _compact_json(obj):
+  orjson = _orjson()
+  if orjson:
+    try:
+      return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    except TypeError:
+      pass
+  return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class StreamFormatter(object):
+  """
+  Formats results to a stream. Pretty formats are flushed per item, so progress shows as it happens.
+  The ndjson format is block buffered, and written out by size or age, or on flush(). Output to a
+  stream with write_records() (like an output.FileSink) is always buffered, and written as whole records.
+  It may be called from several threads at once.
+  """
+
+  def __init__(self, format=None, stream=None):
+    self.format = format
+    self.stream = stream or sys.stdout
+    self._write_records = getattr(self.stream, "write_records", None)
+    self.buffered = format == "ndjson" or self._write_records is not None
+    self._buffer = []
+    self._buffer_size = 0
+    self._last_flush = time.time()
+    self._lock = threading.RLock()
+
+  def __call__(self, obj):
+    text = format_to_string(obj, self.format)
+    with self._lock:
+      if not self.buffered:
+        self.stream.write(text)
+        self.stream.flush()
+        return
+      self._buffer.append(text)
+      self._buffer_size += len(text)
+      if self._buffer_size >= FLUSH_BYTES or time.time() - self._last_flush >= FLUSH_SECONDS:
+        self.flush()
+
+  def flush(self):
+    # Held while writing too, so batches are written in the order they were taken.
+    with self._lock:
+      (buffer, self._buffer, self._buffer_size) = (self._buffer, [], 0)
+      if buffer:
+        if self._write_records:
+          self._write_records(buffer)
+        else:
+          self.stream.write("".join(buffer))
+      self.stream.flush()
+      self._last_flush = time.time()
+
+
+def print_formatter(format=None, stream=None):
+  return StreamFormatter(format, stream)
+
+
+# All data used by the run of a command. Async commands also get an AsyncClient as aio. With --output,
+# list commands save checkpoints with a checkpoint.Checkpointer.
+Config = namedtuple("Config", "github repo formatter aio checkpoints")
+Config.__new__.__defaults__ = (None, None)
 
 
 def _to_dash(name):
@@ -82,16 +190,18 @@ def _is_public_func(f):
   return inspect.isfunction(f) and not f.__name__.startswith("_")
 
 
+def _import_command_module(name):
+  # Use absolute module path so it works post installation.
+  if name == "ghizmo_commands" and "." not in sys.path:
+    sys.path.insert(1, '.')  # This is needed only on some installations.
+  return importlib.import_module(name)
+
+
 @lru_cache()
 def all_command_functions():
   # TODO: Clean this up somehow.
-  # Use absolute module path so it works post installation.
-  modules = [importlib.import_module("ghizmo.commands.%s" % module) for module in commands.__all__]
-
-  # If there is a ghizmo_commands.py file in the current directory, use it too.
-  if os.path.exists("ghizmo_commands.py"):
-    sys.path.insert(1, '.')  # This is needed only on some installations.
-    modules.append(importlib.import_module("ghizmo_commands"))
+  # If there is a ghizmo_commands.py file in the current directory, it is included too.
+  modules = [_import_command_module(name) for name in manifest.command_module_names()]
 
   log.info("Imported command modules: %s", modules)
 
@@ -105,17 +215,25 @@ def all_command_functions():
   return OrderedDict(sorted(list(func_map.items()), key=lambda name_func: (name_func[1].__module__, name_func[0])))
 
 
+def _doc_for_function(func):
+  doc = func.__doc__ and re.sub("\s+", " ", func.__doc__).strip()
+  if not doc:
+    doc = "(no pydoc)"
+  return doc
+
+
+def _generate_command_directory():
+  return [(func.__module__, name, _doc_for_function(func)) for (name, func) in all_command_functions().items()]
+
+
 @lru_cache()
 def command_directory(use_dashes=True):
-  def doc_for_function(func):
-    doc = func.__doc__ and re.sub("\s+", " ", func.__doc__).strip()
-    if not doc:
-      doc = "(no pydoc)"
-    return doc
-
+  """
+  List of (module, command, doc) for all commands, read from the cached manifest when possible, so
+  that command modules don't need to be imported.
+  """
   transform = _to_dash if use_dashes else lambda x: x
-  return [(func.__module__, transform(name), doc_for_function(func)) for (name, func) in
-          all_command_functions().items()]
+  return [(module, transform(name), doc) for (module, name, doc) in manifest.load(_generate_command_directory)]
 
 
 @lru_cache()
@@ -124,10 +242,99 @@ def list_commands(use_dashes=True):
 
 
 def get_command_func(command):
+  """
+  Look up a command function, importing only the module that defines it.
+  """
   command = _to_underscore(command)
-  if not command in all_command_functions():
+  modules = {name: module for (module, name, doc) in command_directory(use_dashes=False)}
+  if not command in modules:
     raise ValueError("invalid command: %s" % command)
-  return all_command_functions()[command]
+  return getattr(_import_command_module(modules[command]), command)
+
+
+def concurrency_of(command_func, jobs=None):
+  """
+  The most requests a command may make at once, given --jobs (or None, for the command's default).
+  Commands that make concurrent requests by default say how many with a concurrency(jobs) attribute.
+  """
+  concurrency = getattr(command_func, "concurrency", None)
+  if concurrency:
+    return concurrency(jobs)
+  if inspect.isasyncgenfunction(command_func) or inspect.iscoroutinefunction(command_func):
+    from ghizmo import aio
+    return jobs or aio.DEFAULT_LIMIT
+  return jobs or 1
+
+
+def run_concurrency(command, jobs=None, repos=False, specs=None):
+  """
+  The most requests a run may make at once, counting commands run on several repos, or batch specs,
+  concurrently, so the connection pool can be sized to match.
+  """
+  if command == BATCH_COMMAND:
+    per_spec = [1]
+    for spec in specs or []:
+      try:
+        spec_jobs = (spec.get("args") or {}).get("jobs")
+        per_spec.append(concurrency_of(get_command_func(spec["command"]), int(spec_jobs) if spec_jobs else jobs))
+      except Exception:
+        # Invalid specs are reported when they're run.
+        pass
+    return (jobs or BATCH_JOBS) * max(per_spec)
+  command_func = get_command_func(command)
+  if not repos:
+    return concurrency_of(command_func, jobs)
+  prepare = getattr(command_func, "prepare_repos", None)
+  return max((jobs or REPO_JOBS) * concurrency_of(command_func, jobs), getattr(prepare, "concurrency", 1))
+
+
+def _run(command_func, config, args, output):
+  """
+  Run a command function, passing each result to output.
+  """
+  fields = projection.parse_fields(args.get("fields"))
+  if fields:
+    output = _projected(output, fields)
+
+  if inspect.isasyncgenfunction(command_func) or inspect.iscoroutinefunction(command_func):
+    # Async commands are driven on an event loop.
+    import asyncio
+    from ghizmo import aio
+    asyncio.run(aio.run(command_func, config, args, output))
+    return
+
+  # This executes the command step by step, either just to display results, or to display progress
+  # on an action with side effects.
+  iterable_result = command_func(config, args)
+  # List commands that return a github3 iterator can have their pages fetched concurrently.
+  jobs = args.get_int("jobs", None)
+  raw = bool(fields or args.get_bool("raw"))
+  if config.checkpoints and pagination.is_paginated(iterable_result):
+    # Long listings to a file can be resumed from a checkpoint.
+    iterable_result = config.checkpoints.iter_items(iterable_result, jobs=jobs or 1, raw=raw)
+  elif raw and pagination.is_paginated(iterable_result):
+    # Raw or projected items only need their JSON, so skip building github3 models for them.
+    iterable_result = pagination.iter_raw_items(iterable_result, jobs=jobs or 1)
+  elif jobs and jobs > 1 and pagination.is_paginated(iterable_result):
+    iterable_result = pagination.iter_items(iterable_result, jobs=jobs)
+  if iterable_result:
+    for result in iterable_result:
+      output(result)
+
+
+def to_serializable(obj):
+  # Heuristic to convert github3 objects to serializable form.
+  return obj.as_dict() if hasattr(obj, "as_dict") else obj
+
+
+def _projected(output, fields):
+  return lambda result: output(projection.project(to_serializable(result), fields))
+
+
+def _flush(formatter):
+  flush = getattr(formatter, "flush", None)
+  if flush:
+    flush()
 
 
 def run_command(command, config, args):
@@ -135,14 +342,191 @@ def run_command(command, config, args):
   log.info("Command '%s' (%s)", command, command_func)
   log.info("Config: %s", config)
   log.info("Args: %s", args)
-  # This executes the command step by step, either just to display results, or to display progress
-  # on an action with side effects.
-  iterable_result = command_func(config, args)
-  if iterable_result:
-    for result in iterable_result:
-      config.formatter(result)
+  try:
+    _run(command_func, config, args, config.formatter)
+  finally:
+    _flush(config.formatter)
+
+
+# Default number of repositories to run on at once, if not set with --jobs.
+REPO_JOBS = 4
+
+_DONE = object()
+
+
+class _Cancelled(Exception):
+  pass
+
+
+def _parse_repo_item(item):
+  if item.startswith("org:") or item.startswith("user:"):
+    (kind, selector) = item.split(":", 1)
+    (name, pattern) = selector.split("/", 1) if "/" in selector else (selector, "*")
+    return (kind, name, pattern)
+  try:
+    (owner, repo_name) = item.split("/")
+  except ValueError:
+    raise ValueError("Invalid repository (use format owner/repo-name, org:name, or user:name): %s" % item)
+  return ("repo", owner, repo_name)
+
+
+def _lookup_repos(github, parsed):
+  (kind, name, selector) = parsed
+  if kind == "repo":
+    repo = github.repository(name, selector)
+    if not repo:
+      raise ValueError("Couldn't access repository: %s/%s" % (name, selector))
+    return [repo]
+  listing = github.organization(name).repositories() if kind == "org" else github.repositories_by(name)
+  return [repo for repo in listing if fnmatch.fnmatch(repo.name, selector)]
+
+
+def resolve_repos(github, spec, jobs=REPO_JOBS):
+  """
+  Resolve a comma-separated list of repositories, each either owner/repo-name, org:org-name, or
+  user:login, where the org and user forms may filter by a name pattern, as in org:OctoTech/api-*.
+  Entries are looked up concurrently. Returns (repos, failures), where failures lists (entry, error)
+  for each entry that couldn't be looked up, so the rest can still be run.
+  """
+  items = [item.strip() for item in spec.split(",") if item.strip()]
+  parsed = OrderedDict((item, _parse_repo_item(item)) for item in items)
+  repos = []
+  failures = []
+  for (item, found, error) in lib.parallel_map(lambda item: _lookup_repos(github, parsed[item]), parsed, jobs=jobs):
+    if error:
+      log.debug("Couldn't resolve repositories: %s", item, exc_info=error)
+      failures.append((item, error))
+    else:
+      repos.extend(found)
+  log.info("Resolved %s repositories from: %s (%s failed)", len(repos), spec, len(failures))
+  return (repos, failures)
+
+
+def _report_failure(error, output):
+  raise error
+
+
+def _run_tagged(tasks, formatter, jobs):
+  """
+  Run tasks, each a (tag, run) pair where run(output) passes results to output, on a pool of threads.
+  Each result is written as the tag plus {"result": ...}, and a failed task is reported as the tag plus
+  {"error": ...} without stopping the others.
+  """
+  results = queue.Queue(maxsize=1000)
+  stopped = threading.Event()
+
+  def put(item):
+    while not stopped.is_set():
+      try:
+        results.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+    raise _Cancelled()
+
+  def run_task(tag, run):
+    try:
+      run(lambda result: put(dict(tag, result=to_serializable(result))))
+    except _Cancelled:
+      return
+    except Exception as e:
+      log.debug("Command failed: %s", tag, exc_info=True)
+      put(dict(tag, error=str(e), error_type=type(e).__name__))
+    put(_DONE)
+
+  executor = ThreadPoolExecutor(max_workers=jobs)
+  futures = []
+  try:
+    for (tag, run) in tasks:
+      futures.append(executor.submit(run_task, tag, run))
+    remaining = len(futures)
+    while remaining:
+      item = results.get()
+      if item is _DONE:
+        remaining -= 1
+      else:
+        formatter(item)
+  finally:
+    stopped.set()
+    for future in futures:
+      future.cancel()
+    executor.shutdown(wait=True)
+    _flush(formatter)
+
+
+def run_command_on_repos(command, config, args, repos, failures=()):
+  """
+  Run a command on each of several repositories, on a pool of threads sharing one session.
+  Each result is tagged with its repository, as {"repo": ..., "result": ...}, and a failure on one
+  repository is reported as {"repo": ..., "error": ...} without stopping the others. Failures from
+  resolve_repos() are reported the same way.
+  """
+  command_func = get_command_func(command)
+  log.info("Command '%s' (%s) on %s repositories", command, command_func, len(repos))
+  # Commands can start work on all repositories up front, like stats GitHub computes in the background.
+  prepare = getattr(command_func, "prepare_repos", None)
+  if prepare:
+    prepare(config, args, repos)
+  tasks = [({"repo": repo.full_name}, functools.partial(_run, command_func, config._replace(repo=repo), args))
+           for repo in repos]
+  tasks += [({"repo": item}, functools.partial(_report_failure, error)) for (item, error) in failures]
+  # Commands reading stdin each get all of it.
+  with lib.shared_input():
+    _run_tagged(tasks, config.formatter, args.get_int("jobs", None) or REPO_JOBS)
+
+
+# Pseudo-command that runs other commands, read as specs from stdin.
+BATCH_COMMAND = "batch"
+BATCH_DOC = "Run many commands in one process, from JSON specs on stdin, like " \
+            "{\"id\": \"a\", \"command\": \"issues\", \"repo\": \"owner/repo-name\", \"args\": {\"state\": \"all\"}}."
+
+# Default number of batch specs to run at once, if not set with --jobs.
+BATCH_JOBS = 1
+
+
+def split_repo(name):
+  try:
+    (owner, repo_name) = name.split("/")
+  except ValueError:
+    raise ValueError("Invalid repository (use format owner/repo-name): %s" % name)
+  return (owner, repo_name)
+
+
+def run_batch(config, args, specs):
+  """
+  Run a command for each spec, each a dict with a command and optionally an id, repo, and args (which
+  override the command line arguments). All share the login and session, and each repository is looked
+  up only once. Results are tagged with the spec id (or position), as {"id": ..., "result": ...}, and
+  a failed spec is reported as {"id": ..., "error": ...}. Specs run in order, or with --jobs, concurrently.
+  """
+  repos = {config.repo.full_name: config.repo} if config.repo else {}
+  repos_lock = threading.Lock()
+
+  def repo_for(name):
+    if not name:
+      return config.repo
+    with repos_lock:
+      if name not in repos:
+        repo = config.github.repository(*split_repo(name))
+        if not repo:
+          raise ValueError("Couldn't access repository: %s" % name)
+        repos[name] = repo
+      return repos[name]
+
+  def run_spec(spec, output):
+    if not isinstance(spec, dict) or "command" not in spec:
+      raise ValueError("Invalid batch spec (must be an object with a command): %r" % (spec,))
+    command_func = get_command_func(spec["command"])
+    _run(command_func, config._replace(repo=repo_for(spec.get("repo"))), args.updated(spec.get("args") or {}),
+         output)
+
+  tasks = []
+  for (position, spec) in enumerate(specs):
+    spec_id = spec.get("id", position) if isinstance(spec, dict) else position
+    tasks.append(({"id": spec_id}, functools.partial(run_spec, spec)))
+  log.info("Running %s batch specs", len(tasks))
+  _run_tagged(tasks, config.formatter, args.get_int("jobs", None) or BATCH_JOBS)
+
 
 # TODO:
 # Control pretty-printing, using one object per line by default, but with --pretty option to print nicely
-# Proper reading of JSON streams (as opposed to line-by-line), for use in piping
-# Prettier SIGPIPE handling
@@ -0,0 +1,164 @@
+"""
+Batched lookups via GitHub's GraphQL API.
+
+A single query resolves up to BATCH_SIZE users or branches, using one aliased field per item. Results
+are converted to the same dict shape as the corresponding REST responses, so output is the same either
+way (apart from a few REST-only fields such as the *_url templates).
+"""
+
+import logging as log
+from urllib.parse import quote
+
+from ghizmo import configs
+
+__author__ = 'jlevy'
+
+BATCH_SIZE = 100
+
+_USER_FIELDS = """
+  login databaseId avatarUrl url name company websiteUrl location email bio isHireable twitterUsername
+  createdAt updatedAt isSiteAdmin
+  followers { totalCount } following { totalCount }
+  repositories(privacy: PUBLIC) { totalCount } gists(privacy: PUBLIC) { totalCount }
+"""
+
+_BRANCH_FIELDS = """
+  name
+  branchProtectionRule { id }
+  target {
+    ... on Commit {
+      oid url message
+      author { name email date }
+      committer { name email date }
+      parents(first: 10) { nodes { oid } }
+    }
+  }
+"""
+
+
+class GraphQLError(Exception):
+  pass
+
+
+def graphql_url(session):
+  """
+  The GraphQL endpoint, set with graphql_url in the config file or else derived from the REST API URL.
+  """
+  url = configs.get_setting("graphql_url")
+  if url:
+    return url
+  base_url = session.base_url.rstrip("/")
+  if base_url.endswith("/api/v3"):
+    # GitHub Enterprise.
+    return base_url[:-len("/v3")] + "/graphql"
+  return base_url + "/graphql"
+
+
+def _rest_user(api_url, node):
+  return {
+    "login": node["login"],
+    "id": node["databaseId"],
+    "type": "User",
+    "site_admin": node["isSiteAdmin"],
+    "url": "%s/users/%s" % (api_url, node["login"]),
+    "html_url": node["url"],
+    "avatar_url": node["avatarUrl"],
+    "name": node["name"],
+    "company": node["company"],
+    "blog": node["websiteUrl"] or "",
+    "location": node["location"],
+    "email": node["email"] or None,
+    "hireable": node["isHireable"] or None,
+    "bio": node["bio"],
+    "twitter_username": node["twitterUsername"],
+    "public_repos": node["repositories"]["totalCount"],
+    "public_gists": node["gists"]["totalCount"],
+    "followers": node["followers"]["totalCount"],
+    "following": node["following"]["totalCount"],
+    "created_at": node["createdAt"],
+    "updated_at": node["updatedAt"],
+  }
+
+
+def _rest_branch(api_url, html_url, owner, repo_name, node):
+  repo_api_url = "%s/repos/%s/%s" % (api_url, owner, repo_name)
+  commit = node["target"]
+  return {
+    "name": node["name"],
+    "protected": node["branchProtectionRule"] is not None,
+    "commit": {
+      "sha": commit["oid"],
+      "url": "%s/commits/%s" % (repo_api_url, commit["oid"]),
+      "html_url": commit["url"],
+      "commit": {
+        "message": commit["message"],
+        "author": commit["author"],
+        "committer": commit["committer"],
+        "url": "%s/git/commits/%s" % (repo_api_url, commit["oid"]),
+      },
+      "parents": [{"sha": parent["oid"], "url": "%s/commits/%s" % (repo_api_url, parent["oid"])}
+                  for parent in commit["parents"]["nodes"]],
+    },
+    "_links": {
+      "self": "%s/branches/%s" % (repo_api_url, quote(node["name"], safe="")),
+      "html": "%s/%s/%s/tree/%s" % (html_url, owner, repo_name, node["name"]),
+    },
+  }
+
+
+class GraphQLClient(object):
+  """
+  Runs GraphQL queries on an authenticated (github3) requests session.
+  """
+
+  def __init__(self, session, url=None):
+    self.session = session
+    self.url = url or graphql_url(session)
+    self.api_url = session.base_url.rstrip("/")
+    # GitHub Enterprise serves the API under /api/v3 of the web URL.
+    self.html_url = self.api_url[:-len("/api/v3")] if self.api_url.endswith("/api/v3") else "https://github.com"
+
+  def query(self, query, variables=None):
+    response = self.session.post(self.url, json={"query": query, "variables": variables or {}})
+    response.raise_for_status()
+    result = response.json()
+    errors = result.get("errors") or []
+    # Lookups of missing items give NOT_FOUND errors alongside null data; anything else is a failure.
+    other_errors = [error for error in errors if error.get("type") != "NOT_FOUND"]
+    if other_errors or result.get("data") is None:
+      raise GraphQLError("GraphQL query failed: %s" % "; ".join(error.get("message", "%s" % error)
+                                                                for error in other_errors or errors))
+    if errors:
+      log.debug("GraphQL: %s items not found", len(errors))
+    return result["data"]
+
+  def users(self, logins):
+    """
+    Look up a batch of users by login, returning a list of REST-style user dicts (None if not found).
+    """
+    if not logins:
+      return []
+    params = ", ".join("$l%s: String!" % i for i in range(len(logins)))
+    fields = "\n".join("u%s: user(login: $l%s) { ...userFields }" % (i, i) for i in range(len(logins)))
+    query = "query(%s) {\n%s\n}\nfragment userFields on User {%s}" % (params, fields, _USER_FIELDS)
+    data = self.query(query, {"l%s" % i: login for (i, login) in enumerate(logins)})
+    nodes = [data["u%s" % i] for i in range(len(logins))]
+    return [node and _rest_user(self.api_url, node) for node in nodes]
+
+  def branches(self, owner, repo_name, names):
+    """
+    Look up a batch of branches by name, returning a list of REST-style branch dicts (None if not found).
+    """
+    if not names:
+      return []
+    params = ", ".join(["$owner: String!", "$name: String!"] + ["$b%s: String!" % i for i in range(len(names))])
+    fields = "\n".join("b%s: ref(qualifiedName: $b%s) { ...branchFields }" % (i, i) for i in range(len(names)))
+    query = "query(%s) {\nrepository(owner: $owner, name: $name) {\n%s\n}\n}\nfragment branchFields on Ref {%s}" \
+            % (params, fields, _BRANCH_FIELDS)
+    variables = {"owner": owner, "name": repo_name}
+    variables.update({"b%s" % i: "refs/heads/%s" % name for (i, name) in enumerate(names)})
+    repository = self.query(query, variables)["repository"]
+    if repository is None:
+      raise GraphQLError("Repository not found: %s/%s" % (owner, repo_name))
+    nodes = [repository["b%s" % i] for i in range(len(names))]
+    return [node and _rest_branch(self.api_url, self.html_url, owner, repo_name, node) for node in nodes]
@@ -0,0 +1,226 @@
+"""
+Per-run performance instrumentation, for the --profile and --trace options.
+
+A Profiler records every HTTP request made on the session (endpoint, latency, bytes, cache hits,
+rate limit quota) and the time spent formatting output. At the end of a run it prints a summary to
+stderr, and can write all spans as a trace file in Chrome's trace event format, which can be loaded
+in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from collections import defaultdict
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from ghizmo.transport import WrappingAdapter, wrap_adapters
+
+__author__ = 'jlevy'
+
+Span = namedtuple("Span", "name category start duration thread args")
+
+# Bytes are those received over the network. For a cache hit, that's just the 304 (with no body), and the
+# body served from the cache is counted as cached_bytes.
+RequestStat = namedtuple("RequestStat", "endpoint status latency bytes cached_bytes from_cache")
+
+_NUMBER_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_SHA_SEGMENT = re.compile(r"/[0-9a-f]{40}(?=/|$)")
+
+
+def endpoint_of(method, url):
+  """
+  Group requests by endpoint, e.g. "GET /repos/owner/name/issues/:n" (query strings omitted).
+  """
+  path = _SHA_SEGMENT.sub("/:sha", _NUMBER_SEGMENT.sub("/:n", urlparse(url).path))
+  return "%s %s" % (method, path)
+
+
+def percentile(sorted_values, fraction):
+  if not sorted_values:
+    return 0.0
+  return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class _Quota(object):
+
+  def __init__(self, remaining, reset):
+    self.first_remaining = remaining
+    self.remaining = remaining
+    self.reset = reset
+    self.used_in_earlier_windows = 0
+
+  def update(self, remaining, reset):
+    if reset != self.reset:
+      # The quota reset during the run.
+      self.used_in_earlier_windows += self.first_remaining - self.remaining + 1
+      self.first_remaining = remaining
+      self.reset = reset
+    self.remaining = remaining
+
+  @property
+  def used(self):
+    return self.used_in_earlier_windows + self.first_remaining - self.remaining + 1
+
+
+class Profiler(object):
+  """
+  Collects spans and request statistics for one run. Safe to use from multiple threads.
+  """
+
+  def __init__(self):
+    self.start = time.time()
+    self.spans = []
+    self.requests = []
+    self.quotas = OrderedDict()
+    self.items = 0
+    self.format_seconds = 0.0
+    self._lock = threading.Lock()
+
+  def add_span(self, name, category, start, duration, args=None):
+    with self._lock:
+      self.spans.append(Span(name, category, start, duration, threading.get_ident(), args or {}))
+
+  @contextmanager
+  def span(self, name, category="run", args=None):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.add_span(name, category, start, time.time() - start, args)
+
+  def record_request(self, request, response, start, latency, streamed=False):
+    from_cache = getattr(response, "from_cache", False)
+    cached_size = 0
+    if streamed:
+      size = int(response.headers.get("Content-Length") or 0)
+    elif from_cache:
+      (size, cached_size) = (0, len(response.content or b""))
+    else:
+      size = len(response.content or b"")
+    endpoint = endpoint_of(request.method, request.url)
+    stat = RequestStat(endpoint, response.status_code, latency, size, cached_size, from_cache)
+    with self._lock:
+      self.requests.append(stat)
+      self._update_quota(response)
+    self.add_span(endpoint, "http", start, latency,
+                  {"url": request.url, "status": response.status_code, "bytes": size, "cached_bytes": cached_size,
+                   "from_cache": from_cache})
+
+  def _update_quota(self, response):
+    try:
+      remaining = int(response.headers["X-RateLimit-Remaining"])
+      reset = int(response.headers["X-RateLimit-Reset"])
+    except (KeyError, ValueError):
+      return
+    resource = response.headers.get("X-RateLimit-Resource", "core")
+    if resource in self.quotas:
+      self.quotas[resource].update(remaining, reset)
+    else:
+      self.quotas[resource] = _Quota(remaining, reset)
+
+  def install(self, session):
+    """
+    Record all requests on a requests session. Install last, so cache hits are seen as such.
+    """
+    wrap_adapters(session, lambda adapter: ProfilingAdapter(adapter, self))
+
+  def wrap_formatter(self, formatter):
+    return _TimedFormatter(formatter, self)
+
+  def report(self):
+    """
+    A human-readable summary of the run.
+    """
+    elapsed = time.time() - self.start
+    with self._lock:
+      requests = list(self.requests)
+    latencies = sorted(stat.latency for stat in requests)
+    cached = sum(1 for stat in requests if stat.from_cache)
+    received = sum(stat.bytes for stat in requests)
+    cached_bytes = sum(stat.cached_bytes for stat in requests)
+    lines = [
+      "ghizmo profile: %.2fs, %s items (%.1f items/s)" % (elapsed, self.items, self.items / elapsed if elapsed else 0),
+      "  requests: %s (%s from cache), %s received, %s served from cache" % (
+        len(requests), cached, _format_bytes(received), _format_bytes(cached_bytes)),
+      "  latency: p50 %.3fs, p90 %.3fs, p99 %.3fs, max %.3fs" % (
+        percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99), percentile(latencies, 1)),
+      "  serializing output: %.2fs" % self.format_seconds,
+    ]
+    for (resource, quota) in self.quotas.items():
+      lines.append("  rate limit (%s): %s used, %s remaining" % (resource, quota.used, quota.remaining))
+
+    by_endpoint = defaultdict(list)
+    for stat in requests:
+      by_endpoint[stat.endpoint].append(stat)
+    if by_endpoint:
+      lines.append("  %7s %7s %10s %8s %8s  %s" % ("count", "cached", "bytes", "p50", "p90", "endpoint"))
+      for (endpoint, stats) in sorted(by_endpoint.items(), key=lambda item: -len(item[1])):
+        endpoint_latencies = sorted(stat.latency for stat in stats)
+        lines.append("  %7s %7s %10s %7.3fs %7.3fs  %s" % (
+          len(stats), sum(1 for stat in stats if stat.from_cache), _format_bytes(sum(stat.bytes for stat in stats)),
+          percentile(endpoint_latencies, 0.5), percentile(endpoint_latencies, 0.9), endpoint))
+    return "\n".join(lines) + "\n"
+
+  def write_trace(self, path):
+    """
+    Write all spans as a JSON trace in Chrome's trace event format.
+    """
+    pid = os.getpid()
+    with self._lock:
+      events = [{"name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": span.thread,
+                 "ts": int((span.start - self.start) * 1e6), "dur": int(span.duration * 1e6), "args": span.args}
+                for span in self.spans]
+    with open(path, "w") as f:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _format_bytes(size):
+  for unit in ["B", "KB", "MB"]:
+    if size < 1024:
+      return "%.0f%s" % (size, unit) if unit == "B" else "%.1f%s" % (size, unit)
+    size /= 1024.0
+  return "%.1fGB" % size
+
+
+class ProfilingAdapter(WrappingAdapter):
+
+  def __init__(self, inner, profiler):
+    super().__init__(inner)
+    self.profiler = profiler
+
+  def send(self, request, **kwargs):
+    start = time.time()
+    response = self.inner.send(request, **kwargs)
+    # Streamed responses are read by the caller later, so those aren't included in the latency.
+    streamed = kwargs.get("stream", False)
+    if not streamed:
+      response.content
+    self.profiler.record_request(request, response, start, time.time() - start, streamed=streamed)
+    return response
+
+
+class _TimedFormatter(object):
+  """
+  Wraps a formatter to count items and time spent formatting them.
+  """
+
+  def __init__(self, formatter, profiler):
+    self.formatter = formatter
+    self.profiler = profiler
+
+  def __call__(self, obj):
+    start = time.time()
+    self.formatter(obj)
+    self.profiler.format_seconds += time.time() - start
+    self.profiler.items += 1
+
+  def flush(self):
+    flush = getattr(self.formatter, "flush", None)
+    if flush:
+      with self.profiler.span("flush", "output"):
+        flush()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """
-If commands require input, it must be line-delimited JSON (e.g. quoted strings).
+If commands require input, it must be a stream of JSON values (e.g. quoted strings), one per
+line or pretty-printed, as from jq.
 
 For further documentation, see: https://github.com/jlevy/ghizmo
 """
@@ -9,7 +10,7 @@ import logging as log
 import sys
 import os
 import argparse
-from ghizmo.commands.lib import to_bool
+from ghizmo.commands.lib import to_bool, input_json_values
 
 __author__ = 'jlevy'
 
@@ -65,6 +66,16 @@ class UserArgs(object):
     val = self.get(item, default)
     return None if val is None else float(val)
 
+  def updated(self, d):
+    """
+    A copy of these arguments, with d added as explicit arguments.
+    """
+    copy = UserArgs()
+    copy.dict = dict(self.dict)
+    copy._explicit_keys = [key for key in self._explicit_keys if key not in d]
+    copy.add_explicit(d)
+    return copy
+
   def __getattr__(self, item):
     try:
       return self.dict[item]
@@ -75,17 +86,20 @@ class UserArgs(object):
     return ", ".join(["%s=%s" % (key, self.dict[key]) for key in self._explicit_keys])
 
 
-def assemble_args(cmdline_args):
-  assembled = UserArgs()
-
-  user_arg_list = cmdline_args.arg or []
+def parse_key_values(items, kind="argument"):
   d = {}
-  for arg in user_arg_list:
+  for item in items or []:
     try:
-      (key, value) = arg.split("=", 1)
+      (key, value) = item.split("=", 1)
     except:
-      raise ValueError("Could not parse argument -- invalid format: '%s'" % arg)
+      raise ValueError("Could not parse %s -- invalid format: '%s'" % (kind, item))
     d[key] = value
+  return d
+
+
+def assemble_args(cmdline_args):
+  assembled = UserArgs()
+  d = parse_key_values(cmdline_args.arg)
 
   # Arguments are explicit, from command line, and from environment.
   assembled.add_implicit(os.environ)
@@ -93,16 +107,52 @@ def assemble_args(cmdline_args):
   assembled.add_explicit({
     "dry_run": cmdline_args.dry_run,
     "force": cmdline_args.force,
-    "format": cmdline_args.format
+    "format": cmdline_args.format,
+    "jobs": cmdline_args.jobs,
+    "unordered": cmdline_args.unordered,
+    "graphql": cmdline_args.graphql,
+    "local": cmdline_args.local,
+    "fields": cmdline_args.fields,
+    "raw": cmdline_args.raw
   })
 
   return assembled
 
 
+def _run_safely(run, profiler=None, trace_path=None, sink=None):
+  try:
+    if profiler:
+      with profiler.span("run_command"):
+        run()
+    else:
+      run()
+  except BrokenPipeError:
+    # Output was closed early (e.g. piped to head). Exit quietly, as other Unix tools do, pointing
+    # stdout at /dev/null so the interpreter's final flush doesn't fail again.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
+  finally:
+    if sink:
+      sink.close()
+    if profiler:
+      print(profiler.report(), end="", file=sys.stderr)
+      if trace_path:
+        profiler.write_trace(trace_path)
+        print("Wrote trace: %s" % trace_path, file=sys.stderr)
+
+
 def main():
   # Bootstrap logging right up front, so we do it before assembling commands for help.
   log_setup(log.DEBUG if "--debug" in sys.argv else log.WARN)
 
+  # Forward the command to a running daemon, if one is configured (see ghizmo.daemon).
+  if os.environ.get("GHIZMO_DAEMON"):
+    from ghizmo import daemon
+    code = daemon.run_client(os.environ["GHIZMO_DAEMON"], sys.argv[1:])
+    if code is not None:
+      sys.exit(code)
+
   from ghizmo import ghizmo
   from ghizmo import configs
 
@@ -112,29 +162,92 @@ def main():
     "command modules: %s\n" % ", ".join(command_modules) \
     + "(augment by adding to ./ghizmo_commands.py)\n\n" \
     + "commands available:\n" \
-    + "\n".join(["  %s: %s" % (name, doc) for (module, name, doc) in command_directory])
+    + "\n".join(["  %s: %s" % (name, doc) for (module, name, doc) in command_directory]) \
+    + "\n  %s: %s" % (ghizmo.BATCH_COMMAND, ghizmo.BATCH_DOC)
   parser = argparse.ArgumentParser(description=DESCRIPTION,
                                    epilog="\n" + __doc__ + "\n" + command_docs,
                                    formatter_class=argparse.RawTextHelpFormatter)
-  parser.add_argument("command", help="%s command" % NAME, choices=ghizmo.list_commands())
+  parser.add_argument("command", help="%s command" % NAME, choices=ghizmo.list_commands() + [ghizmo.BATCH_COMMAND])
   parser.add_argument("--username", help="username to log in as")
   parser.add_argument("--repo", help="repo of the form: owner/repo-name")
+  parser.add_argument("--repos", help="run on several repos, as a comma-separated list of owner/repo-name, "
+                                      "org:org-name, or user:login (the last two may add /name-pattern)")
   parser.add_argument("--debug", help="enable debugging output", action="store_true")
+  parser.add_argument("--profile", help="print a performance report to stderr at the end of the run",
+                      action="store_true")
+  parser.add_argument("--trace", help="with --profile, write a trace of requests to this file (Chrome trace format)")
+  parser.add_argument("--no-cache", help="don't use the persistent HTTP response cache", action="store_true")
+  parser.add_argument("--transport", help="HTTP transport setting of the form key=value (may repeat this), e.g. "
+                                          "read_timeout=30, pool_maxsize=32, keep_alive=false, compression=false",
+                      action="append")
 
   # Command arguments:
   parser.add_argument("-f", "--force", help="enable debugging output", action="store_true")
   parser.add_argument("-n", "--dry-run", help="dry run: log actions but don't do anything", action="store_true")
-  parser.add_argument("--format", help="output format", choices=["json", "yaml"])
+  parser.add_argument("--format", help="output format (ndjson is compact, one object per line)",
+                      choices=ghizmo.FORMATS)
+  parser.add_argument("-o", "--output", help="write output to this file instead of stdout, compressed if it ends in "
+                                            ".gz (gzip) or .zst (zstd)")
+  parser.add_argument("--resume", help="with --output, continue an interrupted list command from its last "
+                                       "checkpoint", action="store_true")
+  parser.add_argument("--rotate-records", help="with --output, start a new numbered file after this many records",
+                      type=int)
+  parser.add_argument("--rotate-size", help="with --output, start a new numbered file after this much output "
+                                           "(before compression), e.g. 500M")
+  parser.add_argument("--fields", help="output only these fields, as a comma-separated list of dotted paths "
+                                       "(e.g. number,title,user.login)")
+  parser.add_argument("--raw", help="for list commands, output items as the API returns them, without building "
+                                    "objects for them (faster for large dumps)", action="store_true")
+  parser.add_argument("-j", "--jobs", help="number of concurrent requests, for commands that support it",
+                      type=int)
+  parser.add_argument("--unordered", help="with --jobs, output results as they complete, not in input order",
+                      action="store_true")
+  parser.add_argument("--graphql", help="batch lookups via the GraphQL API, for commands that support it",
+                      action="store_true")
+  parser.add_argument("--local", help="use the local mirror (see the sync command), for commands that support it",
+                      action="store_true")
   parser.add_argument("-a", "--arg", help="argument of the form key=value (may repeat this)", action="append")
   parser.add_argument('--version', action='version', version=VERSION)
 
   args = parser.parse_args()
 
+  profiler = None
+  if args.profile or args.trace:
+    from ghizmo import instrument
+    profiler = instrument.Profiler()
+
+  # Batch specs are read up front, so the connection pool can be sized for the commands they run.
+  specs = list(input_json_values()) if args.command == ghizmo.BATCH_COMMAND else None
+  concurrency = ghizmo.run_concurrency(args.command, jobs=args.jobs, repos=bool(args.repos), specs=specs)
+
   # Validate credentials and log in.
-  gh = ghizmo.login(username=args.username)
+  gh = ghizmo.login(username=args.username, use_cache=not args.no_cache, concurrency=concurrency,
+                    transport_settings=parse_key_values(args.transport, "transport setting"))
   if not gh:
     raise ValueError("Login failure")
 
+  sink = None
+  if args.output:
+    from ghizmo import output
+    sink = output.FileSink(args.output, rotate_records=args.rotate_records,
+                           rotate_bytes=output.parse_size(args.rotate_size))
+  formatter = ghizmo.print_formatter(args.format, stream=sink)
+  if profiler:
+    profiler.install(gh.session)
+    formatter = profiler.wrap_formatter(formatter)
+
+  if args.resume and (not args.output or args.repos or args.command == ghizmo.BATCH_COMMAND):
+    raise ValueError("--resume works only for a single command with --output")
+
+  if args.repos:
+    if args.command == ghizmo.BATCH_COMMAND:
+      raise ValueError("Batch specs each give their own repo, so --repos can't be used with batch")
+    (repos, failures) = ghizmo.resolve_repos(gh, args.repos, jobs=args.jobs or ghizmo.REPO_JOBS)
+    config = ghizmo.Config(github=gh, repo=None, formatter=formatter)
+    _run_safely(lambda: ghizmo.run_command_on_repos(args.command, config, assemble_args(args), repos, failures),
+                profiler=profiler, trace_path=args.trace, sink=sink)
+    return
+
   # Validate repository.
   owner = None
   repo_name = None
@@ -156,10 +269,21 @@ def main():
       raise ValueError("Couldn't access repository: %s/%s" % (owner, repo_name))
 
   # Assemble config for this run.
-  formatter = ghizmo.print_formatter(args.format)
-  config = ghizmo.Config(github=gh, repo=repo, formatter=formatter)
-
-  ghizmo.run_command(args.command, config, assemble_args(args))
+  checkpoints = None
+  if sink and args.command != ghizmo.BATCH_COMMAND:
+    from ghizmo import checkpoint
+    key = [args.command, args.format, args.fields, args.raw, os.path.abspath(args.output), args.rotate_records,
+           args.rotate_size]
+    checkpoints = checkpoint.Checkpointer(sink, formatter, key, resume=args.resume)
+  config = ghizmo.Config(github=gh, repo=repo, formatter=formatter, checkpoints=checkpoints)
+
+  if args.command == ghizmo.BATCH_COMMAND:
+    _run_safely(lambda: ghizmo.run_batch(config, assemble_args(args), specs),
+                profiler=profiler, trace_path=args.trace, sink=sink)
+    return
+
+  _run_safely(lambda: ghizmo.run_command(args.command, config, assemble_args(args)),
+              profiler=profiler, trace_path=args.trace, sink=sink)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+"""
+Cached manifest of available commands (module, name, and doc for each), so the command line can be
+assembled without importing every command module and its dependencies.
+
+The manifest is regenerated whenever any command module, including ./ghizmo_commands.py, changes.
+"""
+
+import logging as log
+import os
+import hashlib
+import importlib.util
+
+from ghizmo import configs
+from ghizmo import commands
+
+__author__ = 'jlevy'
+
+LOCAL_COMMANDS_FILE = "ghizmo_commands.py"
+
+_VERSION = 1
+
+
+def command_module_names():
+  names = ["ghizmo.commands.%s" % module for module in commands.__all__]
+  if os.path.exists(LOCAL_COMMANDS_FILE):
+    names.append("ghizmo_commands")
+  return names
+
+
+def _module_path(name):
+  if name == "ghizmo_commands":
+    return os.path.abspath(LOCAL_COMMANDS_FILE)
+  return importlib.util.find_spec(name).origin
+
+
+def _fingerprint():
+  fingerprint = []
+  for name in command_module_names():
+    path = _module_path(name)
+    stat = os.stat(path)
+    fingerprint.append([name, path, stat.st_mtime_ns, stat.st_size])
+  return fingerprint
+
+
+def _manifest_path(fingerprint):
+  # Each set of module files (which varies with a local ghizmo_commands.py) gets its own manifest.
+  paths = "\n".join(path for (name, path, mtime, size) in fingerprint)
+  digest = hashlib.sha1(paths.encode("utf-8")).hexdigest()[:16]
+  return os.path.join(configs.cache_dir(), "manifests", "commands-%s.json" % digest)
+
+
+def _read(path, fingerprint):
+  manifest = configs.load_state(path)
+  if not manifest or manifest.get("version") != _VERSION or manifest.get("fingerprint") != fingerprint:
+    return None
+  return manifest["commands"]
+
+
+def _write(path, fingerprint, command_list):
+  try:
+    configs.save_state(path, {"version": _VERSION, "fingerprint": fingerprint, "commands": command_list})
+  except OSError:
+    log.debug("couldn't write command manifest: %s", path, exc_info=True)
+
+
+def load(generate):
+  """
+  Return a list of [module, name, doc] for all commands, using the cached manifest if it's current
+  or else calling generate() (which imports everything) and caching the result.
+  """
+  fingerprint = _fingerprint()
+  path = _manifest_path(fingerprint)
+  command_list = _read(path, fingerprint)
+  if command_list is None:
+    log.info("Generating command manifest: %s", path)
+    command_list = [list(entry) for entry in generate()]
+    _write(path, fingerprint, command_list)
+  return command_list
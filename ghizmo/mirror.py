@@ -0,0 +1,202 @@
+"""
+Local SQLite mirror of a repository's issues and pull requests.
+
+The mirror is kept up to date incrementally: issues are fetched with since= the last updated_at seen,
+and pull requests (which have no since= filter) are listed most recently updated first until reaching
+ones already seen. Queries support the same filters as the issues and pull requests APIs, answered
+from indexed tables.
+"""
+
+import logging as log
+import os
+import json
+import sqlite3
+
+from ghizmo import configs
+
+__author__ = 'jlevy'
+
+ISSUE = "issue"
+PULL = "pull"
+
+# Commit (and for issues, record progress) every so many items, so an interrupted sync isn't lost.
+COMMIT_EVERY = 500
+
+_SCHEMA = """
+create table if not exists items (
+  kind text not null,
+  number integer not null,
+  state text not null,
+  title text,
+  user_login text,
+  milestone_number integer,
+  comments integer,
+  created_at text,
+  updated_at text,
+  json text not null,
+  primary key (kind, number)
+);
+create index if not exists items_state on items (kind, state);
+create index if not exists items_milestone on items (kind, milestone_number);
+create index if not exists items_created on items (kind, created_at);
+create index if not exists items_updated on items (kind, updated_at);
+
+create table if not exists labels (
+  kind text not null,
+  number integer not null,
+  name text not null,
+  primary key (kind, number, name)
+);
+create index if not exists labels_name on labels (kind, name);
+
+create table if not exists assignees (
+  kind text not null,
+  number integer not null,
+  login text not null,
+  primary key (kind, number, login)
+);
+create index if not exists assignees_login on assignees (kind, login);
+
+create table if not exists sync_state (
+  kind text primary key,
+  updated_at text
+);
+"""
+
+_SORT_COLUMNS = {"created": "created_at", "updated": "updated_at", "comments": "comments"}
+
+
+def mirror_path(repo_full_name):
+  return os.path.join(configs.cache_dir(), "mirror", "%s.sqlite" % repo_full_name)
+
+
+def connect(repo_full_name, create=False):
+  path = mirror_path(repo_full_name)
+  if not create and not os.path.exists(path):
+    raise ValueError("No local mirror for %s (run the sync command first)" % repo_full_name)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  db = sqlite3.connect(path)
+  db.executescript(_SCHEMA)
+  return db
+
+
+def _store(db, kind, item):
+  number = item["number"]
+  milestone = item.get("milestone")
+  assignees = {assignee["login"] for assignee in item.get("assignees") or []}
+  if item.get("assignee"):
+    assignees.add(item["assignee"]["login"])
+  db.execute("insert or replace into items values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+             (kind, number, item["state"], item.get("title"), (item.get("user") or {}).get("login"),
+              milestone and milestone["number"], item.get("comments"), item.get("created_at"),
+              item.get("updated_at"), json.dumps(item)))
+  db.execute("delete from labels where kind = ? and number = ?", (kind, number))
+  db.executemany("insert into labels values (?, ?, ?)",
+                 [(kind, number, label["name"]) for label in item.get("labels") or []])
+  db.execute("delete from assignees where kind = ? and number = ?", (kind, number))
+  db.executemany("insert into assignees values (?, ?, ?)", [(kind, number, login) for login in assignees])
+
+
+def _get_mark(db, kind):
+  row = db.execute("select updated_at from sync_state where kind = ?", (kind,)).fetchone()
+  return row and row[0]
+
+
+def _set_mark(db, kind, updated_at):
+  db.execute("insert or replace into sync_state values (?, ?)", (kind, updated_at))
+
+
+def sync(repo, full=False):
+  """
+  Bring the mirror of a repository up to date, yielding status messages.
+  """
+  db = connect(repo.full_name, create=True)
+  try:
+    if full:
+      for table in ["items", "labels", "assignees", "sync_state"]:
+        db.execute("delete from %s" % table)
+
+    # Issues (which include PRs, in their issue form), oldest updates first, so progress can be saved.
+    mark = _get_mark(db, ISSUE)
+    count = 0
+    for issue in repo.issues(state="all", since=mark, sort="updated", direction="asc"):
+      item = issue.as_dict()
+      _store(db, ISSUE, item)
+      mark = max(mark or "", item["updated_at"])
+      count += 1
+      if count % COMMIT_EVERY == 0:
+        _set_mark(db, ISSUE, mark)
+        db.commit()
+    _set_mark(db, ISSUE, mark)
+    db.commit()
+    yield {"message": "Synced %s new or updated issues" % count, "kind": ISSUE, "updated_at": mark}
+
+    # Pull requests, newest updates first, until reaching those already mirrored.
+    old_mark = _get_mark(db, PULL)
+    mark = old_mark
+    count = 0
+    for pr in repo.pull_requests(state="all", sort="updated", direction="desc"):
+      item = pr.as_dict()
+      if old_mark and item["updated_at"] < old_mark:
+        break
+      _store(db, PULL, item)
+      mark = max(mark or "", item["updated_at"])
+      count += 1
+      if count % COMMIT_EVERY == 0:
+        db.commit()
+    _set_mark(db, PULL, mark)
+    db.commit()
+    yield {"message": "Synced %s new or updated pull requests" % count, "kind": PULL, "updated_at": mark}
+  finally:
+    db.close()
+
+
+def query(repo_full_name, kind, state=None, labels=None, assignee=None, milestone=None, since=None,
+          sort=None, direction=None, number=-1):
+  """
+  Yield mirrored issues or pull requests (as API JSON) matching the same filters as the API.
+  """
+  where = ["kind = ?"]
+  params = [kind]
+  state = state or "open"
+  if state != "all":
+    where.append("state = ?")
+    params.append(state)
+  if assignee == "none":
+    where.append("not exists (select 1 from assignees a where a.kind = items.kind and a.number = items.number)")
+  elif assignee == "*":
+    where.append("exists (select 1 from assignees a where a.kind = items.kind and a.number = items.number)")
+  elif assignee:
+    where.append("exists (select 1 from assignees a where a.kind = items.kind and a.number = items.number "
+                 "and a.login = ?)")
+    params.append(assignee)
+  if milestone == "none":
+    where.append("milestone_number is null")
+  elif milestone == "*":
+    where.append("milestone_number is not null")
+  elif milestone:
+    where.append("milestone_number = ?")
+    params.append(int(milestone))
+  for label in [label.strip() for label in (labels or "").split(",") if label.strip()]:
+    where.append("exists (select 1 from labels l where l.kind = items.kind and l.number = items.number "
+                 "and l.name = ?)")
+    params.append(label)
+  if since:
+    where.append("updated_at >= ?")
+    params.append(since)
+
+  sort_column = _SORT_COLUMNS.get(sort or "created")
+  if not sort_column:
+    raise ValueError("Invalid sort: %s" % sort)
+  order = "asc" if direction == "asc" else "desc"
+  sql = "select json from items where %s order by %s %s, number %s" % (" and ".join(where), sort_column, order, order)
+  if number is not None and int(number) >= 0:
+    sql += " limit %d" % int(number)
+
+  log.debug("Mirror query: %s %s", sql, params)
+  db = connect(repo_full_name)
+  try:
+    for (item_json,) in db.execute(sql, params):
+      yield json.loads(item_json)
+  finally:
+    db.close()
@@ -0,0 +1,242 @@
+"""
+File output for large dumps, optionally compressed and rotated.
+
+Records are handed to a writer thread through a bounded queue, so compression (which releases the GIL)
+runs alongside fetching, and a slow disk or compressor just applies backpressure. Compression is
+chosen by file extension: .gz for gzip, or .zst for zstd (if the zstandard package is installed).
+
+For checkpoints, the writer can make everything so far durable and report the position, at which the
+output can later be cut off and continued.
+"""
+
+import logging as log
+import os
+import re
+import gzip
+import queue
+import threading
+
+__author__ = 'jlevy'
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Batches of records queued for the writer thread.
+QUEUE_SIZE = 64
+
+_CLOSE = object()
+
+_SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+  """
+  Parse a byte size, like 500000, 100K, 10M, or 2G.
+  """
+  if value is None:
+    return None
+  m = re.match(r"^\s*(\d+)\s*([KMG]?)B?\s*$", str(value), re.IGNORECASE)
+  if not m:
+    raise ValueError("Invalid size: %s" % value)
+  return int(m.group(1)) * _SIZE_SUFFIXES[m.group(2).upper()]
+
+
+def compression_for(path):
+  if path.endswith(".gz"):
+    return "gzip"
+  elif path.endswith(".zst"):
+    return "zstd"
+  return None
+
+
+def rotated_path(path, index):
+  """
+  Path for the index'th rotated file, numbered before the extensions, as in issues-00002.ndjson.gz.
+  """
+  (directory, name) = os.path.split(path)
+  (stem, dot, extensions) = name.partition(".")
+  return os.path.join(directory, "%s-%05d%s%s" % (stem, index, dot, extensions))
+
+
+def _check_compression(compression):
+  if compression == "zstd":
+    try:
+      import zstandard  # noqa: F401
+    except ImportError:
+      raise ValueError("Writing .zst files requires the zstandard package (pip install zstandard)")
+
+
+def _start_member(raw, compression):
+  """
+  Start a new compressed stream (a gzip member or zstd frame) on a raw file. A series of these
+  concatenated is itself a valid compressed file, so a file can be cut off after any of them.
+  """
+  if compression == "gzip":
+    return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+  elif compression == "zstd":
+    import zstandard
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+  return raw
+
+
+class _Checkpoint(object):
+
+  def __init__(self, save):
+    self.save = save
+
+
+class FileSink(object):
+  """
+  Writes batches of formatted records to a file, or a series of files if rotating by record count or
+  (uncompressed) size. Rotation only happens between records.
+
+  The file is opened when first written, truncating it, unless restore() is called first to continue
+  it from a checkpoint position.
+  """
+
+  def __init__(self, path, rotate_records=None, rotate_bytes=None):
+    self.path = path
+    self.compression = compression_for(path)
+    _check_compression(self.compression)
+    self.rotate_records = rotate_records
+    self.rotate_bytes = rotate_bytes
+    self.rotating = bool(rotate_records or rotate_bytes)
+    self.paths = []
+    self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+    self._error = None
+    self._raw = None
+    self._member = None
+    self._file_records = 0
+    self._file_bytes = 0
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self._thread = threading.Thread(target=self._write_loop, name="output-writer", daemon=True)
+    self._thread.start()
+
+  def _path(self, index):
+    return rotated_path(self.path, index) if self.rotating else self.path
+
+  def _end_member(self):
+    if self._member is not None and self._member is not self._raw:
+      self._member.close()
+    self._member = None
+
+  def _close_file(self):
+    if self._raw:
+      self._end_member()
+      self._raw.close()
+      self._raw = None
+
+  def _next_file(self):
+    self._close_file()
+    path = self._path(len(self.paths) + 1)
+    self._raw = open(path, "wb")
+    self._file_records = 0
+    self._file_bytes = 0
+    self.paths.append(path)
+    log.info("Writing output to: %s", path)
+
+  def _full(self):
+    return ((self.rotate_records and self._file_records >= self.rotate_records) or
+            (self.rotate_bytes and self._file_bytes >= self.rotate_bytes))
+
+  def _write(self, texts):
+    if not self._raw or self._full():
+      self._next_file()
+    if self._member is None:
+      self._member = _start_member(self._raw, self.compression)
+    data = "".join(texts).encode("utf-8")
+    self._member.write(data)
+    self._file_records += len(texts)
+    self._file_bytes += len(data)
+
+  def _sync(self):
+    """
+    End the current compressed stream and make everything written so far durable. Returns the position.
+    """
+    if not self._raw:
+      self._next_file()
+    self._end_member()
+    self._raw.flush()
+    os.fsync(self._raw.fileno())
+    return {"file": len(self.paths), "offset": self._raw.tell(), "records": self._file_records,
+            "bytes": self._file_bytes}
+
+  def _write_loop(self):
+    while True:
+      item = self._queue.get()
+      if item is _CLOSE:
+        break
+      if self._error:
+        continue
+      try:
+        if isinstance(item, _Checkpoint):
+          item.save(self._sync())
+        elif self.rotating:
+          for text in item:
+            self._write([text])
+        else:
+          self._write(item)
+      except Exception as e:
+        log.debug("Output writer failed", exc_info=True)
+        self._error = e
+
+  def _check(self):
+    if self._error:
+      raise self._error
+
+  def restore(self, position):
+    """
+    Continue output from a position saved at a checkpoint, cutting off anything written after it.
+    Must be called before anything is written.
+    """
+    assert not self._raw and not self.paths, "Can only restore output before writing"
+    index = position["file"]
+    path = self._path(index)
+    if not os.path.exists(path) or os.path.getsize(path) < position["offset"]:
+      raise ValueError("Can't resume: output file %s is missing or shorter than at the checkpoint" % path)
+    # Files rotated to after the checkpoint will be written again.
+    later = index + 1
+    while self.rotating and os.path.exists(self._path(later)):
+      os.unlink(self._path(later))
+      later += 1
+    self._raw = open(path, "r+b")
+    self._raw.truncate(position["offset"])
+    self._raw.seek(position["offset"])
+    self.paths = [self._path(i) for i in range(1, index + 1)]
+    self._file_records = position["records"]
+    self._file_bytes = position["bytes"]
+    log.info("Resuming output at %s bytes in: %s", position["offset"], path)
+
+  def checkpoint(self, save):
+    """
+    Once all records queued so far are durably written, call save(position) from the writer thread.
+    """
+    self._check()
+    self._queue.put(_Checkpoint(save))
+
+  def write_records(self, records):
+    """
+    Queue a list of formatted records for writing.
+    """
+    self._check()
+    self._queue.put(list(records))
+
+  def write(self, text):
+    self.write_records([text])
+
+  def flush(self):
+    # Records are written out by the writer thread as it gets to them.
+    self._check()
+
+  def close(self):
+    """
+    Finish writing all queued records and close the file (creating it, if there was no output).
+    """
+    self._queue.put(_CLOSE)
+    self._thread.join()
+    if not self._error and not self._raw and not self.paths:
+      self._next_file()
+    self._close_file()
+    self._check()
@@ -0,0 +1,170 @@
+"""
+Concurrent page fetching for github3 list iterators.
+
+github3 iterators request page N+1 only once page N has been consumed. Once the first response gives
+the rel="last" link, though, every page URL is known, so the rest can be fetched concurrently within a
+bounded window and still be emitted in order.
+"""
+
+import logging as log
+import functools
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+__author__ = 'jlevy'
+
+# One fetched page: its URL, the decoded items on it, and the URL of the page after it (or None).
+Page = namedtuple("Page", "url items next_url")
+
+MAX_PER_PAGE = 100
+
+
+def is_paginated(obj):
+  """True if obj is a github3 list iterator (which hasn't started iterating)."""
+  from github3.structs import GitHubIterator
+  return isinstance(obj, GitHubIterator)
+
+
+def _with_page(url, page):
+  parts = urlparse(url)
+  query = [(key, value) for (key, value) in parse_qsl(parts.query, keep_blank_values=True) if key != "page"]
+  query.append(("page", str(page)))
+  return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def _page_number(url):
+  for (key, value) in parse_qsl(urlparse(url).query):
+    if key == "page":
+      return int(value)
+  return None
+
+
+def _page_items(iterator, response):
+  from github3.exceptions import UnprocessableResponseBody
+  json = iterator._get_json(response)
+  if json is None:
+    return []
+  # Some APIs return the list of items inside a dict.
+  if isinstance(json, dict) and iterator.list_key is not None:
+    if iterator.list_key not in json:
+      raise UnprocessableResponseBody("GitHub's API returned a body that could not be handled", json)
+    json = json[iterator.list_key]
+  if isinstance(json, dict):
+    json.pop("ETag", None)
+    json.pop("Last-Modified", None)
+    return list(json.items())
+  return [item for item in json if item is not None]
+
+
+def _fetch(iterator, url, params=None):
+  response = iterator._get(url, params=params, headers=iterator.headers)
+  return (response, _page_items(iterator, response))
+
+
+def _next_url(response):
+  return response.links.get("next", {}).get("url")
+
+
+def iter_pages(iterator, jobs=1, start_url=None):
+  """
+  Yield each Page of a github3 iterator in order, optionally starting from the page at start_url (a
+  next_url from an earlier Page). With jobs > 1, remaining pages are fetched concurrently, with at most
+  jobs * 2 pages fetched ahead of the consumer.
+  """
+  if start_url:
+    (response, items) = _fetch(iterator, start_url)
+  else:
+    params = dict(iterator.params)
+    if 0 < iterator.count <= MAX_PER_PAGE:
+      params["per_page"] = iterator.count
+    elif "per_page" not in params:
+      params["per_page"] = MAX_PER_PAGE
+    (response, items) = _fetch(iterator, iterator.url, params=params)
+  yield Page(response.url, items, _next_url(response))
+
+  last_url = response.links.get("last", {}).get("url")
+  last_page = last_url and _page_number(last_url)
+  if jobs and jobs > 1 and last_page:
+    log.info("Fetching %s pages with %s jobs: %s", last_page, jobs, iterator.url)
+    first_page = _page_number(response.url) or 1
+    pages = [(_with_page(last_url, page), _with_page(last_url, page + 1) if page < last_page else None)
+             for page in range(first_page + 1, last_page + 1)]
+    for page in _fetch_all(iterator, pages, jobs):
+      yield page
+  else:
+    # Follow rel="next" one page at a time, as github3 does.
+    next_url = _next_url(response)
+    while next_url:
+      (response, items) = _fetch(iterator, next_url)
+      next_url = _next_url(response)
+      yield Page(response.url, items, next_url)
+
+
+def _fetch_all(iterator, pages, jobs):
+  """
+  Fetch pages, given as (url, next_url) pairs, concurrently but yielding them in order.
+  """
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    pending = deque()
+    try:
+      for (url, next_url) in pages:
+        pending.append((url, next_url, executor.submit(_fetch, iterator, url)))
+        if len(pending) >= jobs * 2:
+          (url, next_url, future) = pending.popleft()
+          yield Page(url, future.result()[1], next_url)
+      while pending:
+        (url, next_url, future) = pending.popleft()
+        yield Page(url, future.result()[1], next_url)
+    finally:
+      # If the consumer stops early, don't wait on pages it won't use.
+      for (url, next_url, future) in pending:
+        future.cancel()
+
+
+def model_class(iterator):
+  """
+  Constructor for the github3 model objects of a github3 iterator's items.
+  """
+  from github3.models import GitHubCore
+  cls = iterator.cls
+  if issubclass(cls, GitHubCore):
+    cls = functools.partial(cls, session=iterator)
+  return cls
+
+
+def limit_items(iterator, items, skip=0):
+  """
+  Cut off a stream of items at the github3 iterator's item count limit, if it has one, less any
+  items already output (skip).
+  """
+  remaining = iterator.count
+  if remaining > 0:
+    remaining = max(remaining - skip, 0)
+  if remaining == 0:
+    return
+  for item in items:
+    yield item
+    if remaining > 0:
+      remaining -= 1
+      if remaining == 0:
+        return
+
+
+def iter_items(iterator, jobs=1):
+  """
+  Yield the items of a github3 iterator, as github3 model objects, honoring its item count limit.
+  """
+  cls = model_class(iterator)
+  return limit_items(iterator, (cls(item) for page in iter_pages(iterator, jobs=jobs) for item in page.items))
+
+
+def iter_raw_items(iterator, jobs=1):
+  """
+  Yield the items of a github3 iterator as decoded JSON, without building model objects (except for
+  APIs returning a dict rather than a list of items), honoring its item count limit.
+  """
+  cls = model_class(iterator)
+  return limit_items(iterator, (item if isinstance(item, dict) else cls(item)
+                                for page in iter_pages(iterator, jobs=jobs) for item in page.items))
@@ -0,0 +1,47 @@
+"""
+Projection of results to selected fields, so large objects are cut down before they're serialized.
+
+Fields are dotted paths, as in "number,title,user.login". A path into a list applies to each of its
+items, so "labels.name" gives the names of all labels.
+"""
+
+__author__ = 'jlevy'
+
+
+def parse_fields(spec):
+  """
+  Parse a comma-separated list of dotted paths into a tree of nested dicts, where None marks a field
+  to keep whole. Returns None if there are no fields.
+  """
+  tree = {}
+  for path in [path.strip() for path in (spec or "").split(",") if path.strip()]:
+    node = tree
+    keys = path.split(".")
+    for key in keys[:-1]:
+      if key in node and node[key] is None:
+        # A parent of this path is already kept whole.
+        break
+      node = node.setdefault(key, {})
+    else:
+      node[keys[-1]] = None
+  return tree or None
+
+
+def is_error(obj):
+  return isinstance(obj, dict) and "error" in obj and "error_type" in obj
+
+
+def project(obj, tree):
+  """
+  Project a decoded JSON value to the fields in tree. Missing fields are omitted. Error records are
+  passed through unchanged, so failures aren't hidden.
+  """
+  if isinstance(obj, list):
+    return [project(item, tree) for item in obj]
+  if not isinstance(obj, dict) or is_error(obj):
+    return obj
+  result = {}
+  for (key, subtree) in tree.items():
+    if key in obj:
+      result[key] = obj[key] if subtree is None else project(obj[key], subtree)
+  return result
@@ -0,0 +1,150 @@
+"""
+Rate-limit-aware request scheduling.
+
+Every response updates the known quota (X-RateLimit-Remaining/Reset, per X-RateLimit-Resource).
+Requests run at full speed while the quota is healthy, are spread evenly over the time left once it
+runs low, and wait for the reset once it's exhausted. Secondary rate limits (403/429, with or without
+Retry-After) are retried after backing off.
+"""
+
+import logging as log
+import time
+import threading
+from urllib.parse import urlparse
+
+from ghizmo.transport import WrappingAdapter, wrap_adapters
+
+__author__ = 'jlevy'
+
+# Start spreading requests out when less than this fraction of the quota remains.
+PACE_BELOW = 0.1
+
+MAX_RETRIES = 5
+
+# GitHub asks clients to wait at least a minute after a secondary limit with no Retry-After.
+SECONDARY_BACKOFF = 60
+
+
+def _resource_for(url):
+  path = urlparse(url).path
+  if path.startswith("/search/") or "/api/v3/search/" in path:
+    return "search"
+  if path.endswith("/graphql"):
+    return "graphql"
+  return "core"
+
+
+def _int_header(response, name):
+  value = response.headers.get(name)
+  try:
+    return int(value) if value is not None else None
+  except ValueError:
+    return None
+
+
+class Quota(object):
+
+  def __init__(self, limit, remaining, reset):
+    self.limit = limit
+    self.remaining = remaining
+    self.reset = reset
+
+  def __repr__(self):
+    return "Quota(limit=%s, remaining=%s, reset=%s)" % (self.limit, self.remaining, self.reset)
+
+
+class RateLimitScheduler(object):
+  """
+  Shared, thread-safe view of the quota, used to decide how long to wait before each request.
+  """
+
+  def __init__(self, pace_below=PACE_BELOW, clock=time.time, sleep=time.sleep):
+    self.pace_below = pace_below
+    self.clock = clock
+    self.sleep = sleep
+    self.quotas = {}
+    self._next_slot = {}
+    self._lock = threading.Lock()
+
+  def delay(self, resource):
+    """
+    Reserve a slot for one request on this resource and return how many seconds to wait for it.
+    """
+    with self._lock:
+      now = self.clock()
+      quota = self.quotas.get(resource)
+      if not quota or quota.reset <= now:
+        return 0
+      if quota.remaining <= 0:
+        return quota.reset - now + 1
+      if quota.remaining >= quota.limit * self.pace_below:
+        return 0
+      interval = (quota.reset - now) / quota.remaining
+      slot = max(now, self._next_slot.get(resource, now))
+      self._next_slot[resource] = slot + interval
+      quota.remaining -= 1
+      return slot - now
+
+  def update(self, response):
+    limit = _int_header(response, "X-RateLimit-Limit")
+    remaining = _int_header(response, "X-RateLimit-Remaining")
+    reset = _int_header(response, "X-RateLimit-Reset")
+    if limit is None or remaining is None or reset is None:
+      return
+    resource = response.headers.get("X-RateLimit-Resource") or _resource_for(response.url)
+    with self._lock:
+      self.quotas[resource] = Quota(limit, remaining, reset)
+
+  def retry_delay(self, response, attempt):
+    """
+    Seconds to wait before retrying a rate-limited response, or None if it isn't rate limited.
+    """
+    if response.status_code not in (403, 429):
+      return None
+    retry_after = _int_header(response, "Retry-After")
+    if retry_after is not None:
+      return retry_after
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+      reset = _int_header(response, "X-RateLimit-Reset")
+      if reset:
+        return max(reset - self.clock(), 0) + 1
+    if response.status_code == 429 or b"secondary rate limit" in response.content.lower():
+      return SECONDARY_BACKOFF * 2 ** attempt
+    return None
+
+  def wait(self, seconds, reason):
+    if seconds > 0:
+      if seconds >= 1:
+        log.warning("Rate limit: %s; waiting %.0fs", reason, seconds)
+      self.sleep(seconds)
+
+
+class RateLimitAdapter(WrappingAdapter):
+
+  def __init__(self, inner, scheduler, max_retries=MAX_RETRIES):
+    super().__init__(inner)
+    self.scheduler = scheduler
+    self.max_retries = max_retries
+
+  def send(self, request, **kwargs):
+    resource = _resource_for(request.url)
+    attempt = 0
+    while True:
+      self.scheduler.wait(self.scheduler.delay(resource), "pacing %s requests" % resource)
+      response = self.inner.send(request, **kwargs)
+      self.scheduler.update(response)
+      delay = self.scheduler.retry_delay(response, attempt)
+      if delay is None or attempt >= self.max_retries:
+        return response
+      response.close()
+      attempt += 1
+      self.scheduler.wait(delay, "%s on %s (retry %s)" % (response.status_code, request.url, attempt))
+
+
+def install(session):
+  """
+  Add rate limit scheduling to a requests session. Returns the scheduler.
+  """
+  scheduler = RateLimitScheduler()
+  wrap_adapters(session, lambda adapter: RateLimitAdapter(adapter, scheduler))
+  return scheduler
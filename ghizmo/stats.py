@@ -0,0 +1,136 @@
+"""
+Repository statistics that GitHub computes in the background.
+
+The stats endpoints answer 202 while GitHub computes them, so requesting them once often gets nothing.
+Here a first request kicks off computation for every repository at once, and then those still pending
+are polled, with backoff, until they're ready or a deadline passes. Results are kept locally for a while
+(stats_ttl seconds), since GitHub only recomputes them on push anyway.
+"""
+
+import logging as log
+import os
+import time
+
+from ghizmo import configs
+from ghizmo.commands import lib
+
+__author__ = 'jlevy'
+
+# Defaults, overridable with stats_ttl and stats_wait in the config file or as arguments.
+DEFAULT_TTL = 6 * 3600
+DEFAULT_WAIT = 120
+
+POLL_INITIAL = 1.0
+POLL_MAX = 16.0
+
+_JOBS = 8
+
+
+class StatsTimeout(Exception):
+  pass
+
+
+def _cache_path(repo):
+  return os.path.join(configs.cache_dir(), "stats", "%s.contributors.json" % repo.full_name)
+
+
+def _load_cached(repo, ttl):
+  cached = configs.load_state(_cache_path(repo))
+  if not cached or time.time() - cached["fetched"] > ttl:
+    return None
+  return cached["stats"]
+
+
+def _save(repo, stats):
+  configs.save_state(_cache_path(repo), {"fetched": time.time(), "stats": stats})
+
+
+def _request(repo):
+  """
+  Request contributor stats for a repo, returning them, or None if GitHub is still computing them.
+  """
+  response = repo._get(repo._build_url("stats", "contributors", base_url=repo._api))
+  if response.status_code == 202:
+    return None
+  if response.status_code == 204:
+    # Empty repository.
+    stats = []
+  else:
+    stats = repo._json(response, 200) or []
+  _save(repo, stats)
+  return stats
+
+
+def _request_all(repos, jobs):
+  """
+  Request stats for each repo concurrently, returning a dict of the ones that are ready.
+  """
+  ready = {}
+  for (repo, stats, error) in lib.parallel_map(_request, repos, jobs=jobs):
+    if error:
+      raise error
+    if stats is not None:
+      ready[repo.full_name] = stats
+  return ready
+
+
+def _setting(value, key, default):
+  return float(value if value is not None else configs.get_setting(key, default))
+
+
+def contributor_stats(repos, ttl=None, wait=None, jobs=_JOBS):
+  """
+  Contributor stats for each repo, as a dict from full name to the list of stats (in the REST API's
+  form). Stats fetched less than ttl seconds ago are reused. Raises StatsTimeout if GitHub is still
+  computing them after wait seconds.
+  """
+  ttl = _setting(ttl, "stats_ttl", DEFAULT_TTL)
+  wait = _setting(wait, "stats_wait", DEFAULT_WAIT)
+  deadline = time.time() + wait
+
+  results = {}
+  pending = []
+  for repo in repos:
+    cached = _load_cached(repo, ttl)
+    if cached is not None:
+      results[repo.full_name] = cached
+    else:
+      pending.append(repo)
+
+  delay = POLL_INITIAL
+  while pending:
+    results.update(_request_all(pending, jobs))
+    pending = [repo for repo in pending if repo.full_name not in results]
+    if not pending:
+      break
+    if time.time() + delay > deadline:
+      raise StatsTimeout("GitHub is still computing contributor stats after %ss, try again later: %s"
+                         % (int(wait), ", ".join(repo.full_name for repo in pending)))
+    log.info("Waiting %.0fs for GitHub to compute contributor stats: %s", delay,
+             ", ".join(repo.full_name for repo in pending))
+    time.sleep(delay)
+    delay = min(delay * 2, POLL_MAX)
+  return results
+
+
+def start(repos, ttl=None, jobs=_JOBS):
+  """
+  Kick off computation of contributor stats for each repo without a fresh cached copy, so they're
+  computed in parallel rather than one at a time.
+  """
+  ttl = _setting(ttl, "stats_ttl", DEFAULT_TTL)
+  stale = [repo for repo in repos if _load_cached(repo, ttl) is None]
+  # Best effort: any failure here is left for the command on that repo to report.
+  for (repo, stats, error) in lib.parallel_map(_request, stale, jobs=jobs):
+    if error:
+      log.info("Couldn't request contributor stats for %s: %s", repo.full_name, error)
+
+
+def prepare_repos(config, args, repos):
+  """
+  Hook for commands using contributor stats, so with --repos all are computed at once.
+  """
+  start(repos, ttl=args.get_float("stats_ttl", None))
+
+
+prepare_repos.concurrency = _JOBS
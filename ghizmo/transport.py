@@ -0,0 +1,84 @@
+"""
+HTTP transport layers for the GitHub session.
+
+Each layer is a requests adapter that wraps the adapter already mounted on the session, so features
+(caching, rate limiting, etc.) compose without knowing about each other.
+"""
+
+from collections import namedtuple
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+__author__ = 'jlevy'
+
+# Settings for the network adapter, from the transport section of ~/.ghizmo.yml or --transport.
+# pool_connections is the number of hosts to keep pools for, and pool_maxsize the connections kept per host.
+Settings = namedtuple("Settings", "pool_connections pool_maxsize connect_timeout read_timeout keep_alive compression")
+
+DEFAULT_SETTINGS = Settings(pool_connections=10, pool_maxsize=16, connect_timeout=4.0, read_timeout=10.0,
+                            keep_alive=True, compression=True)
+
+_SETTING_TYPES = {"pool_connections": int, "pool_maxsize": int, "connect_timeout": float, "read_timeout": float,
+                  "keep_alive": bool, "compression": bool}
+
+
+class WrappingAdapter(BaseAdapter):
+  """
+  A requests adapter that delegates to an inner adapter. Subclasses override send().
+  """
+
+  def __init__(self, inner):
+    super().__init__()
+    self.inner = inner
+
+  def send(self, request, **kwargs):
+    return self.inner.send(request, **kwargs)
+
+  def close(self):
+    self.inner.close()
+
+
+def wrap_adapters(session, wrapper):
+  """
+  Wrap every adapter mounted on the session with wrapper(adapter).
+  """
+  for (prefix, adapter) in list(session.adapters.items()):
+    session.mount(prefix, wrapper(adapter))
+
+
+def _convert(key, value):
+  if key not in _SETTING_TYPES:
+    raise ValueError("Unknown transport setting '%s' (known: %s)" % (key, ", ".join(sorted(_SETTING_TYPES))))
+  if _SETTING_TYPES[key] is bool and isinstance(value, str):
+    return value.lower() in ("true", "yes", "1")
+  return _SETTING_TYPES[key](value)
+
+
+def settings(*overrides, concurrency=None):
+  """
+  Transport settings from defaults, updated by each dict of overrides in turn. Unless pool_maxsize is set
+  explicitly, it is raised to the expected number of concurrent requests, so none have to open (and then
+  discard) a connection of their own.
+  """
+  values = DEFAULT_SETTINGS._asdict()
+  for override in overrides:
+    values.update({key: _convert(key, value) for (key, value) in (override or {}).items()})
+  if concurrency and not any(override and "pool_maxsize" in override for override in overrides):
+    values["pool_maxsize"] = max(values["pool_maxsize"], concurrency)
+  return Settings(**values)
+
+
+def install(session, settings=DEFAULT_SETTINGS):
+  """
+  Mount a pooled network adapter on the session, with the given settings. This must be done before
+  wrapping adapters with other layers.
+  """
+  for prefix in ["https://", "http://"]:
+    session.mount(prefix, HTTPAdapter(pool_connections=settings.pool_connections,
+                                      pool_maxsize=settings.pool_maxsize))
+  # github3 sessions pass these as the timeout on every request.
+  session.default_connect_timeout = settings.connect_timeout
+  session.default_read_timeout = settings.read_timeout
+  if not settings.keep_alive:
+    session.headers["Connection"] = "close"
+  if not settings.compression:
+    session.headers["Accept-Encoding"] = "identity"
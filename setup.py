@@ -32,6 +32,7 @@ setup(
   entry_points={
     "console_scripts": [
       "ghizmo = ghizmo.main:main",
+      "ghizmo-daemon = ghizmo.daemon:main",
     ],
   },
 )